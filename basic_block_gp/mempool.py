@@ -0,0 +1,293 @@
+#
+# Dependencies
+#
+
+import json
+import hashlib
+import heapq
+import threading
+from itertools import count
+
+#
+# Define a pool of pending transactions
+#
+
+# Most bytes the pool may take up before it starts evicting transactions
+MAX_BYTES = 16 * 1024 * 1024
+
+# Rough cost in bytes of keeping a transaction, on top of its JSON: the
+# dict itself, its index entries and its heap entries
+ENTRY_OVERHEAD = 512
+
+
+class TransactionRejected(ValueError):
+    """
+    Raised when the pool won't take a transaction
+    """
+
+
+def transaction_id(tx):
+    """
+    :param tx: <dict> Transaction
+    :return: <str> Hex SHA-256 of the transaction's sorted JSON
+    """
+
+    return hashlib.sha256(json.dumps(tx, sort_keys=True).encode()).hexdigest()
+
+
+def make_transaction(sender, recipient, amount, nonce=None):
+    """
+    :param sender: <str> Address of the Sender
+    :param recipient: <str> Address of the Recipient
+    :param amount: <int> Amount
+    :param nonce: (Optional) <str> or <int> Tells apart transactions that
+    are otherwise the same
+    :return: <dict> Transaction, with a `nonce` only if one was given
+    """
+
+    tx = {
+        'sender': sender,
+        'recipient': recipient,
+        'amount': amount,
+    }
+    if nonce is not None:
+        tx['nonce'] = nonce
+    return tx
+
+
+def default_priority(tx):
+    """
+    Mining rewards go first, then everything else in the order it arrived
+
+    :param tx: <dict> Transaction
+    :return: <float> Higher goes into a block sooner
+    """
+
+    return float('inf') if tx['sender'] == '0' else 0
+
+
+class Mempool(object):
+    """
+    The transactions waiting to go into a block
+
+    A transaction is known by its id, and one already waiting is turned
+    away as a duplicate, so a client can safely resend one it isn't sure
+    arrived.  Two payments of the same amount between the same addresses
+    are only told apart by giving them different nonces.
+
+    Entries are indexed by id and by sender.  Two heaps order them by
+    priority, highest first for filling blocks and lowest first for
+    eviction; ties go to whichever arrived first.  Once the pool holds more
+    than `max_bytes`, the lowest priority transactions are evicted to make
+    room.
+
+    Every method takes the pool's own lock, so adding a transaction never
+    waits on anything but another transaction.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES, priority=default_priority):
+        self.max_bytes = max_bytes
+        self.priority = priority
+        self.lock = threading.Lock()
+
+        # (transaction, id, size) by arrival number
+        self.entries = {}
+        # Arrival number of each transaction by id, and of each sender's
+        # transactions
+        self.by_id = {}
+        self.by_sender = {}
+        # (-priority, arrival), best first, and (priority, -arrival), worst
+        # first.  Removed entries are only dropped from the heaps when they
+        # reach the top.
+        self.best = []
+        self.worst = []
+        self.size = 0
+        self.arrivals = count()
+
+    def add(self, tx):
+        """
+        Add a transaction to the pool
+
+        :param tx: <dict> Transaction
+        :return: <str> The transaction's id
+        :raise TransactionRejected: If the transaction is already waiting, or
+        the pool is full of transactions with a higher priority
+        """
+
+        tx_id = self.add_many([tx])[0]
+        if isinstance(tx_id, TransactionRejected):
+            raise tx_id
+        return tx_id
+
+    def add_many(self, transactions):
+        """
+        Add a batch of transactions, taking the lock only once
+
+        :param transactions: <list> Transactions
+        :return: <list> For each transaction, its id, or the
+        TransactionRejected saying why it wasn't added
+        """
+
+        # Encode and hash outside the lock
+        entries = []
+        for tx in transactions:
+            encoded = json.dumps(tx, sort_keys=True).encode()
+            entries.append((tx, hashlib.sha256(encoded).hexdigest(),
+                            len(encoded) + ENTRY_OVERHEAD, self.priority(tx)))
+
+        results = []
+        with self.lock:
+            for entry in entries:
+                try:
+                    results.append(self.insert(*entry))
+                except TransactionRejected as e:
+                    results.append(e)
+            self.compact()
+        return results
+
+    def insert(self, tx, tx_id, size, priority):
+        """
+        Add one transaction, with the lock held
+
+        Everything that can reject the transaction is checked before the
+        pool changes, so a rejected one leaves it as it was.
+        """
+
+        # The sender keys `by_sender`
+        if not isinstance(tx['sender'], str):
+            raise TransactionRejected('Invalid Sender')
+        if tx_id in self.by_id:
+            raise TransactionRejected('Duplicate Transaction')
+        if size > self.max_bytes:
+            raise TransactionRejected('Transaction Too Large')
+
+        # Find room among anything with a lower priority, putting it back
+        # if there isn't enough
+        evicted = []
+        freed = 0
+        while self.size - freed + size > self.max_bytes:
+            worst = self.peek(self.worst)
+            if worst is None or self.worst[0][0] >= priority:
+                for entry in evicted:
+                    heapq.heappush(self.worst, entry)
+                raise TransactionRejected('Transaction Pool Full')
+            evicted.append(heapq.heappop(self.worst))
+            freed += self.entries[worst][2]
+        for _, arrival in evicted:
+            self.discard(-arrival)
+
+        arrival = next(self.arrivals)
+        self.entries[arrival] = (tx, tx_id, size)
+        self.by_id[tx_id] = arrival
+        self.by_sender.setdefault(tx['sender'], set()).add(arrival)
+        heapq.heappush(self.best, (-priority, arrival))
+        heapq.heappush(self.worst, (priority, -arrival))
+        self.size += size
+        return tx_id
+
+    def take(self, limit):
+        """
+        Remove and return the highest priority transactions
+
+        :param limit: <int> Most transactions to take
+        :return: <list> Transactions, highest priority first
+        """
+
+        taken = []
+        with self.lock:
+            while len(taken) < limit:
+                arrival = self.peek(self.best)
+                if arrival is None:
+                    break
+                taken.append(self.entries[arrival][0])
+                self.discard(arrival)
+            self.compact()
+        return taken
+
+    def remove(self, transactions):
+        """
+        Drop transactions from the pool, e.g. once a block confirms them
+
+        :param transactions: <list> Transactions, which needn't be in the pool
+        """
+
+        with self.lock:
+            for tx in transactions:
+                arrival = self.by_id.get(transaction_id(tx))
+                if arrival is not None:
+                    self.discard(arrival)
+            self.compact()
+
+    def get(self, tx_id):
+        """
+        :param tx_id: <str> A transaction's id
+        :return: <dict> The transaction, or None if it isn't in the pool
+        """
+
+        with self.lock:
+            arrival = self.by_id.get(tx_id)
+            return self.entries[arrival][0] if arrival is not None else None
+
+    def from_sender(self, sender):
+        """
+        :param sender: <str> An address
+        :return: <list> The sender's transactions in the pool
+        """
+
+        with self.lock:
+            return [self.entries[arrival][0]
+                    for arrival in self.by_sender.get(sender, ())]
+
+    def peek(self, heap):
+        """
+        :return: <int> Arrival number of the entry at the top of `heap`,
+        after popping any that have been removed, or None if it is empty
+        """
+
+        while heap:
+            arrival = abs(heap[0][1])
+            if arrival in self.entries:
+                return arrival
+            heapq.heappop(heap)
+        return None
+
+    def discard(self, arrival):
+        tx, tx_id, size = self.entries.pop(arrival)
+        del self.by_id[tx_id]
+        senders = self.by_sender[tx['sender']]
+        senders.discard(arrival)
+        if not senders:
+            del self.by_sender[tx['sender']]
+        self.size -= size
+
+    def compact(self):
+        """
+        Rebuild the heaps once removed entries make up most of them
+        """
+
+        if max(len(self.best), len(self.worst)) <= 2 * len(self.entries) + 64:
+            return
+
+        self.best = []
+        self.worst = []
+        for arrival, (tx, tx_id, size) in self.entries.items():
+            priority = self.priority(tx)
+            self.best.append((-priority, arrival))
+            self.worst.append((priority, -arrival))
+        heapq.heapify(self.best)
+        heapq.heapify(self.worst)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, tx):
+        return transaction_id(tx) in self.by_id
+
+    def __iter__(self):
+        """
+        Transactions in the order they arrived
+        """
+
+        with self.lock:
+            transactions = [self.entries[arrival][0] for arrival in sorted(self.entries)]
+        return iter(transactions)
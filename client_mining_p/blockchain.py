@@ -2,23 +2,99 @@
 # Dependencies
 #
 
+import os
+import sys
 import hashlib
 import json
+import atexit
+import logging
+import signal
 from time import time
 from uuid import uuid4
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from blockstore import Block, BlockStore
+from mempool import MAX_BYTES, Mempool, TransactionRejected, make_transaction
+
+#
+# Define logging
+#
+
+# Each subsystem logs to its own `blockchain.<subsystem>` logger, so its
+# level can be set on its own
+validation_log = logging.getLogger('blockchain.validation')
+mining_log = logging.getLogger('blockchain.mining')
+
+
+def configure_logging(spec):
+    """
+    Set log levels from a spec such as 'info,validation=debug,mining=off'
+
+    A bare level applies to every subsystem, and `subsystem=level` sets one
+    subsystem.  Per-block traces are logged at debug level.
+    :param spec: <str> Comma separated levels
+    """
+
+    logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+    logging.getLogger('blockchain').setLevel(logging.INFO)
+
+    for part in spec.split(','):
+        subsystem, _, level = part.strip().rpartition('=')
+        if not level:
+            continue
+        logger = logging.getLogger('blockchain' + (f'.{subsystem}' if subsystem else ''))
+        if level.lower() == 'off':
+            logger.setLevel(logging.CRITICAL + 1)
+        else:
+            logger.setLevel(level.upper())
 
 #
 # Define data structure
 #
 
+# Number of leading zero bits the hash of a valid proof must have
+DIFFICULTY = 24
+
+
+def proof_target(difficulty=DIFFICULTY):
+    """
+    Precompute the difficulty check used by `valid_guess`
+
+    A hash has `difficulty` leading zero bits exactly when its first `size`
+    bytes, read as a big-endian integer, are less than `limit`.
+    :param difficulty: <int> Number of leading zero bits
+    :return: <tuple> (size, limit)
+    """
+
+    size = (difficulty + 7) // 8
+    return size, 1 << (size * 8 - difficulty)
+
+
+TARGET = proof_target()
+
+# Most transactions a new block takes from the mempool
+BLOCK_TRANSACTIONS = 1000
+
+# The verified checkpoint is saved to this file, next to the block store's
+# segments, every CHECKPOINT_INTERVAL blocks and when the node shuts down
+CHECKPOINT_FILE = 'checkpoint.json'
+CHECKPOINT_INTERVAL = 100
+
 class Blockchain(object):
-    def __init__(self):
-        self.chain = []
-        self.current_transactions = []
+    def __init__(self, store=None, mempool=None):
+        # Blocks live in `store` when one is given, otherwise in memory
+        self.chain = store if store is not None else []
+        # Transactions waiting to go into a block
+        self.mempool = mempool if mempool is not None else Mempool()
         self.nodes = set()
 
-        self.new_block(previous_hash=1, proof=100)
+        # How many blocks at the start of the chain are known to be valid,
+        # and the hash of the last of them
+        self.verified_height = 0
+        self.verified_hash = None
+
+        if not self.chain:
+            self.new_block(previous_hash=1, proof=100)
+        self.load_checkpoint()
 
     def new_block(self, proof, previous_hash=None):
         """
@@ -29,38 +105,106 @@ class Blockchain(object):
         :return: <dict> New Block
         """
 
-        block = {
+        block = Block({
             'index': len(self.chain) + 1,
             'timestamp': time(),
-            'transactions': self.current_transactions,
+            'transactions': self.mempool.take(BLOCK_TRANSACTIONS),
             'proof': proof,
             'previous_hash': previous_hash or self.hash(self.chain[-1]),
-        }
-
-        # Reset the current list of transactions
-        self.current_transactions = []
+        })
 
         self.chain.append(block)
+        self.advance_checkpoint()
+        if len(self.chain) % CHECKPOINT_INTERVAL == 0:
+            self.save_checkpoint()
         return block
 
-    def new_transaction(self, sender, recipient, amount):
+    def new_transaction(self, sender, recipient, amount, nonce=None):
         """
         Creates a new transaction to go into the next mined Block
 
         :param sender: <str> Address of the Recipient
         :param recipient: <str> Address of the Recipient
         :param amount: <int> Amount
+        :param nonce: (Optional) <str> or <int> Tells apart transactions that
+        are otherwise the same
         :return: <int> The index of the BLock that will hold this transaction
+        :raise TransactionRejected: If the mempool won't take it
         """
 
-        self.current_transactions.append({
-            'sender': sender,
-            'recipient': recipient,
-            'amount': amount,
-        })
+        self.mempool.add(make_transaction(sender, recipient, amount, nonce))
 
         return self.last_block['index'] + 1
 
+    def new_transactions(self, transactions):
+        """
+        Creates a batch of transactions to go into the next mined Blocks
+
+        The whole batch goes into the mempool in one go.
+        :param transactions: <list> Dicts with the same `sender`, `recipient`,
+        `amount` and optional `nonce` that `new_transaction` takes
+        :return: <list> For each transaction, its id if it was accepted, or
+        the TransactionRejected saying why not
+        """
+
+        return self.mempool.add_many([make_transaction(
+            values['sender'], values['recipient'], values['amount'], values.get('nonce'),
+        ) for values in transactions])
+
+    @staticmethod
+    def header(block):
+        """
+        Strip a Block down to its header
+
+        :param block: <dict> Block
+        :return: <dict> The block without its transactions, but with a count
+        of them, their `transaction_root` and the block's own hash
+        """
+
+        header = {k: v for k, v in block.items() if k != 'transactions'}
+        header['transaction_count'] = len(block['transactions'])
+        header['transaction_root'] = Blockchain.transaction_root(block['transactions'])
+        header['hash'] = Blockchain.hash(block)
+        return header
+
+    @staticmethod
+    def transaction_root(transactions):
+        """
+        Merkle root of a block's transactions
+
+        Each transaction is hashed as sorted JSON, then neighbouring hashes
+        are hashed together in pairs, the last one pairing with itself on
+        levels of odd length, until one hash is left.
+        :param transactions: <list> The block's transactions
+        :return: <str> Hex SHA-256 root, or None if there are none
+        """
+
+        level = [hashlib.sha256(json.dumps(tx, sort_keys=True).encode()).digest()
+                 for tx in transactions]
+        if not level:
+            return None
+
+        while len(level) > 1:
+            if len(level) % 2:
+                level.append(level[-1])
+            level = [hashlib.sha256(level[i] + level[i + 1]).digest()
+                     for i in range(0, len(level), 2)]
+        return level[0].hex()
+
+    @staticmethod
+    def encode(block):
+        """
+        The sorted JSON of a Block, which is what gets hashed and proven
+
+        :param block: <dict> Block
+        :return: <bytes>
+        """
+
+        # Sealed blocks remember their encoding
+        if isinstance(block, Block):
+            return block.encoded
+        return json.dumps(block, sort_keys=True).encode()
+
     @staticmethod
     def hash(block):
         """
@@ -77,7 +221,11 @@ class Blockchain(object):
         # We must make sure that the Dictionary is Ordered,
         # or we'll have inconsistent hashes
 
-        block_string = json.dumps(block, sort_keys=True).encode()
+        # Sealed blocks remember their hash
+        if isinstance(block, Block):
+            return block.hash
+
+        block_string = Blockchain.encode(block)
 
         # By itself, this function returns the hash in a raw string
         # that will likely include escaped characters.
@@ -91,53 +239,74 @@ class Blockchain(object):
         return self.chain[-1]
 
     @staticmethod
-    def valid_proof(block_string, proof):
+    def proof_prefix(block_string):
+        """
+        Hash the part of every guess that does not change
+
+        Each guess is `f'{block_string}{proof}'`, so the block string can be
+        hashed once and the hash state copied for every proof that is tried.
+        :param block_string: <bytes> The stringified block
+        :return: <hashlib hash> SHA-256 state after hashing the block string
+        """
+
+        return hashlib.sha256(f'{block_string}'.encode())
+
+    @staticmethod
+    def valid_guess(prefix, proof, target=TARGET):
+        """
+        Validates the Proof against a precomputed `proof_prefix`.  Gives the
+        same answer as `valid_proof(block_string, proof)` without re-hashing
+        the block string.
+        :param prefix: <hashlib hash> The result of `proof_prefix`
+        :param proof: <int?> The proof to check
+        :param target: <tuple> The result of `proof_target`
+        :return: True if the resulting hash is a valid proof, False otherwise
+        """
+
+        guess_hash = prefix.copy()
+        guess_hash.update(f'{proof}'.encode())
+
+        size, limit = target
+        return int.from_bytes(guess_hash.digest()[:size], 'big') < limit
+
+    @staticmethod
+    def valid_proof(block_string, proof, target=TARGET):
         """
-        Validates the Proof:  Does hash(block_string, proof) contain 6
-        leading zeroes?  Return true if the proof is valid
+        Validates the Proof:  Does hash(block_string, proof) have `DIFFICULTY`
+        leading zero bits?  Return true if the proof is valid
         :param block_string: <string> The stringified block to use to
         check in combination with `proof`
         :param proof: <int?> The value that when combined with the
         stringified previous block results in a hash that has the
-        correct number of leading zeroes.
+        correct number of leading zero bits.
         :return: True if the resulting hash is a valid proof, False otherwise
         """
 
-        guess = f'{block_string}{proof}'.encode()
-        guess_hash = hashlib.sha256(guess).hexdigest()
-
-        # if guess_hash[:3] == "000":
-        #     print(f"guess: {guess}, guess_hash {guess_hash} | {guess_hash[:3]} == '000' #=> {guess_hash[:3] == '000'}")
-
-        return guess_hash[:6] == "000000"
-        # return guess_hash[:3] == "000"
+        return Blockchain.valid_guess(Blockchain.proof_prefix(block_string), proof, target)
 
-    def valid_chain(self, chain):
+    def valid_chain(self, chain, start=0):
         """
         Determine if a given blockchain is valid.  We'll need this
         later when we are a part of a network.
 
         :param chain: <list> A blockchain
+        :param start: (Optional) <int> Position of a block already known to
+        be valid.  Only the blocks after it are checked.
         :return: <bool> True if valid, False if not
         """
 
-        prev_block = chain[0]
-        current_index = 1
+        prev_block = chain[start]
+        current_index = start + 1
+
+        # Look the level up once rather than once per block
+        trace = validation_log.isEnabledFor(logging.DEBUG)
 
         while current_index < len(chain):
             block = chain[current_index]
-            print(f'{prev_block}')
-            print(f'{block}')
-            print("\n-------------------\n")
-            # Check that the hash of the block is correct
-            if block['previous_hash'] != self.hash(prev_block):
-                print(f"Invalid previous hash on block {current_index}")
-                return False
-
-            # Check that the Proof of Work is correct
-            block_string = json.dumps(prev_block, sort_keys=True).encode()
-            if not self.valid_proof(block_string, block['proof']):
-                print(f"Found invalid proof on block {current_index}")
+            if trace:
+                validation_log.debug('Checking block %d\n%s\n%s',
+                                     current_index, prev_block, block)
+            if not self.valid_link(prev_block, block, current_index):
                 return False
 
             prev_block = block
@@ -145,6 +314,129 @@ class Blockchain(object):
 
         return True
 
+    def valid_link(self, prev_block, block, current_index):
+        """
+        Check that `block` correctly follows `prev_block`
+
+        :param prev_block: <dict> Block
+        :param block: <dict> The Block after it
+        :param current_index: <int> Position of `block`, for messages
+        :return: <bool> True if valid, False if not
+        """
+
+        # Check that the hash of the block is correct
+        if block['previous_hash'] != self.hash(prev_block):
+            validation_log.warning('Invalid previous hash on block %d', current_index)
+            return False
+
+        # Check that the Proof of Work is correct
+        block_string = self.encode(prev_block)
+        if not self.valid_proof(block_string, block['proof']):
+            validation_log.warning('Found invalid proof on block %d', current_index)
+            return False
+
+        return True
+
+    def validate(self, full=False):
+        """
+        Determine if our own chain is valid
+
+        Blocks up to the verified checkpoint aren't checked again unless
+        `full` is given.
+        :param full: (Optional) <bool> Revalidate the whole chain
+        :return: <bool> True if valid, False if not
+        """
+
+        if full:
+            self.verified_height = 0
+
+        return self.advance_checkpoint()
+
+    def advance_checkpoint(self):
+        """
+        Check the blocks added since the verified checkpoint
+
+        The checkpoint is the number of blocks at the start of the chain
+        known to be valid, along with the hash of the last of them.  It
+        moves up to the last valid block, so each block is only checked
+        once as the chain grows.  If the chain has been replaced beneath
+        the checkpoint, checking starts again from the genesis block.
+        :return: <bool> True if the whole chain is valid, False if not
+        """
+
+        height = self.verified_height
+        if height and (height > len(self.chain) or
+                       self.hash(self.chain[height - 1]) != self.verified_hash):
+            height = 0
+
+        # The genesis block is taken on trust
+        height = max(height, 1)
+
+        valid = True
+        while height < len(self.chain):
+            if not self.valid_link(self.chain[height - 1], self.chain[height], height):
+                valid = False
+                break
+            height += 1
+
+        self.verified_height = height
+        self.verified_hash = self.hash(self.chain[height - 1])
+        return valid
+
+    def checkpoint_path(self):
+        """
+        :return: <str> Where the verified checkpoint is saved, or None when
+        the chain is only kept in memory
+        """
+
+        if isinstance(self.chain, BlockStore):
+            return os.path.join(self.chain.path, CHECKPOINT_FILE)
+        return None
+
+    def load_checkpoint(self):
+        """
+        Pick the verified checkpoint up from where `save_checkpoint` left it,
+        so a restart doesn't check the whole chain again
+
+        If the block it was saved at is no longer on the chain,
+        `advance_checkpoint` starts again from the genesis block.
+        """
+
+        path = self.checkpoint_path()
+        if path is None or not os.path.exists(path):
+            return
+
+        try:
+            with open(path) as file:
+                saved = json.load(file)
+            self.verified_height = saved['verified_height']
+            self.verified_hash = saved['verified_hash']
+        except (OSError, ValueError, KeyError) as e:
+            validation_log.warning('Ignoring unreadable %s: %s', path, e)
+
+    def save_checkpoint(self):
+        """
+        Write the verified checkpoint next to the block store, for
+        `load_checkpoint` to pick up on the next start
+        """
+
+        path = self.checkpoint_path()
+        if path is None:
+            return
+
+        saved = json.dumps({
+            'verified_height': self.verified_height,
+            'verified_hash': self.verified_hash,
+        })
+
+        # Written aside and moved into place, so a crash part way through
+        # leaves the last good file
+        with open(path + '.tmp', 'w') as file:
+            file.write(saved)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + '.tmp', path)
+
 #
 # Define a web API using Flask.
 #
@@ -158,6 +450,102 @@ node_identifier = str(uuid4()).replace('-', '')
 # Instantiate the Blockchain
 blockchain = Blockchain()
 
+# Query arguments that ask for one page of the chain, and the most blocks a
+# page may hold
+PAGE_ARGS = ('from', 'to', 'cursor', 'limit')
+PAGE_SIZE = 100
+
+# Most transactions `/transactions/batch` takes in one request
+BATCH_LIMIT = 10000
+
+# Formats `/chain?stream=` can send the chain in, with their mimetypes
+STREAM_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def valid_amount(amount):
+    """
+    :param amount: The amount of a transaction
+    :return: <bool> True if it is a positive number of coins
+    """
+
+    return isinstance(amount, (int, float)) and not isinstance(amount, bool) and amount > 0
+
+
+def valid_transaction(values):
+    """
+    :param values: <dict> A transaction's fields, as sent to us
+    :return: <bool> True if its addresses are strings, its amount a
+    positive number of coins, and its nonce, if any, a string or integer
+    """
+
+    nonce = values.get('nonce')
+    return (isinstance(values['sender'], str) and isinstance(values['recipient'], str)
+            and valid_amount(values['amount'])
+            and (nonce is None or isinstance(nonce, (str, int)) and not isinstance(nonce, bool)))
+
+
+def page_bounds(args, length):
+    """
+    Work out which blocks a paginated request is asking for
+
+    `from` and `to` are inclusive block indexes, defaulting to the whole
+    chain.  At most `limit` blocks are returned per page, and the returned
+    cursor is passed back as `cursor` to get the next page.
+    :param args: <dict> The request's query arguments
+    :param length: <int> Length of the chain
+    :return: <tuple> (first index, last index, cursor or None when done)
+    """
+
+    start = int(args.get('cursor', args.get('from', 1)))
+    end = min(int(args.get('to', length)), length)
+    limit = min(int(args.get('limit', PAGE_SIZE)), PAGE_SIZE)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+
+    start = max(start, 1)
+    stop = min(end, start + limit - 1)
+    cursor = stop + 1 if stop < end else None
+
+    return start, stop, cursor
+
+
+def stream_chain(chain, stream_format):
+    """
+    Serialize `chain` one block at a time
+
+    Stored blocks are sent as the bytes already on disk, so neither the
+    chain nor the response body is ever held in memory as a whole.
+    :param chain: <list> A blockchain, or a BlockStore
+    :param stream_format: <str> 'json' for the same object `/chain` sends, or
+    'ndjson' for one block per line
+    :return: <generator> The response body in chunks of bytes
+    """
+
+    # Blocks appended while we stream aren't sent
+    length = len(chain)
+
+    if stream_format == 'json':
+        yield b'{"chain": ['
+
+    for position in range(length):
+        if isinstance(chain, BlockStore):
+            block = chain.read_bytes(position)
+        else:
+            block = Blockchain.encode(chain[position])
+
+        if stream_format == 'ndjson':
+            yield block + b'\n'
+        elif position:
+            yield b', ' + block
+        else:
+            yield block
+
+    if stream_format == 'json':
+        yield b'], "length": %d}' % length
+
 
 @app.route('/mine', methods=['POST'])
 def mine():
@@ -167,12 +555,12 @@ def mine():
         proof = values['proof']
 
         # Validate or reject proof of work.
-        block_string = json.dumps(blockchain.last_block, sort_keys=True).encode()
+        block_string = blockchain.encode(blockchain.last_block)
         is_valid = blockchain.valid_proof(block_string, proof)
     else:
         proof = None
 
-    if proof and is_valid:
+    if proof is not None and is_valid:
         # We must receive a reward for finding the proof.
         # The sender is "0" to signify that this node has mined a new coin
         # The recipient is the current node, it did the mining!
@@ -181,11 +569,14 @@ def mine():
             sender="0",
             recipient=node_identifier,
             amount=1,
+            # A fresh nonce, so no two rewards are ever the same transaction
+            nonce=uuid4().hex,
         )
 
         # Forge the new Block by adding it to the chain
         previous_hash = blockchain.hash(blockchain.last_block)
         block = blockchain.new_block(proof, previous_hash)
+        mining_log.info('Forged block %d with proof %s', block['index'], proof)
 
         # Send a response with reward
         response = {
@@ -197,6 +588,9 @@ def mine():
         }
         return jsonify(response), 200
     else:
+        mining_log.info('Rejected proof %s for block %d', proof,
+                        blockchain.last_block['index'] + 1)
+
         # Send a response with rejection
         response = {
             'message': "New proof rejected"
@@ -208,38 +602,146 @@ def mine():
 def new_transaction():
     values = request.get_json()
 
-    if values is None:
+    if not isinstance(values, dict):
         return 'Missing Values', 400
 
     # Check that the required fields are in the POST'ed data
     required = ['sender', 'recipient', 'amount']
     if not all(k in values for k in required):
         return 'Missing Values', 400
+    if not valid_transaction(values):
+        return 'Invalid Values', 400
 
     # Create a new Transaction
-    index = blockchain.new_transaction(values['sender'],
-                                       values['recipient'],
-                                       values['amount'])
+    try:
+        index = blockchain.new_transaction(values['sender'],
+                                           values['recipient'],
+                                           values['amount'],
+                                           values.get('nonce'))
+    except TransactionRejected as e:
+        return str(e), 400
 
     response = {'message': f'Transaction will be added to Block {index}'}
     return jsonify(response), 201
 
 
+@app.route('/transactions/batch', methods=['POST'])
+def new_transactions():
+    # Take a JSON array, or one transaction per line as NDJSON
+    if request.mimetype == 'application/x-ndjson':
+        items = []
+        for line in request.get_data().splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            return 'Expected a JSON array or NDJSON', 400
+
+    if len(items) > BATCH_LIMIT:
+        return f'At most {BATCH_LIMIT} transactions per batch', 413
+
+    # Check every transaction in one pass, before any of them is created,
+    # so one bad item can't fail the batch part way through
+    required = ['sender', 'recipient', 'amount']
+    results = [None] * len(items)
+    wellformed = []
+    for position, values in enumerate(items):
+        if values is None:
+            results[position] = {'error': 'Invalid JSON'}
+        elif not isinstance(values, dict) or not all(k in values for k in required):
+            results[position] = {'error': 'Missing Values'}
+        elif not valid_transaction(values):
+            results[position] = {'error': 'Invalid Values'}
+        else:
+            wellformed.append(position)
+
+    # Create the new Transactions
+    ids = blockchain.new_transactions([items[position] for position in wellformed])
+    for position, tx_id in zip(wellformed, ids):
+        if isinstance(tx_id, TransactionRejected):
+            results[position] = {'error': str(tx_id)}
+        else:
+            results[position] = {'id': tx_id}
+
+    accepted = sum('id' in result for result in results)
+    response = {
+        'message': f'{accepted} transactions will be added to Block {blockchain.last_block["index"] + 1}',
+        'accepted': accepted,
+        'results': results,
+    }
+    return jsonify(response), 201
+
+
 @app.route('/chain', methods=['GET'])
 def full_chain():
+    # With any of the paging arguments, send a single page
+    if any(k in request.args for k in PAGE_ARGS):
+        return chain_page(blockchain.chain, lambda block: block)
+
+    # Stream the chain rather than building the whole body up front
+    if 'stream' in request.args:
+        stream_format = request.args['stream'] or 'json'
+        if stream_format not in STREAM_FORMATS:
+            return 'Invalid stream format', 400
+        return Response(stream_chain(blockchain.chain, stream_format),
+                        mimetype=STREAM_FORMATS[stream_format])
+
     response = {
-        'chain': blockchain.chain,
+        'chain': list(blockchain.chain),
         'length': len(blockchain.chain)
     }
     return jsonify(response), 200
 
 
+@app.route('/headers', methods=['GET'])
+def headers():
+    return chain_page(blockchain.chain, blockchain.header)
+
+
+def chain_page(chain, view):
+    """
+    Respond with one page of `chain`, each block passed through `view`
+    """
+
+    try:
+        start, stop, cursor = page_bounds(request.args, len(chain))
+    except ValueError:
+        return 'Invalid range', 400
+
+    response = {
+        'chain': [view(block) for block in chain[start - 1:stop]],
+        'length': len(chain),
+        'next': cursor,
+    }
+    return jsonify(response), 200
+
+
+@app.route('/blocks/<int:index>', methods=['GET'])
+def block_by_index(index):
+    if not 1 <= index <= len(blockchain.chain):
+        return 'Block Not Found', 404
+
+    response = {
+        'block': blockchain.chain[index - 1]
+    }
+    return jsonify(response), 200
+
+
 @app.route('/valid-chain', methods=['GET'])
 def validate_chain():
-    result = blockchain.valid_chain(blockchain.chain)
+    # Only blocks added since the last validation are checked, unless a
+    # full revalidation is asked for with `?full=1`
+    full = request.args.get('full', '').lower() in ('1', 'true', 'yes')
+    result = blockchain.validate(full)
 
     response = {
-        'validity': result
+        'validity': result,
+        'verified_height': blockchain.verified_height,
     }
     return jsonify(response), 200
 
@@ -249,11 +751,28 @@ def last_block():
     result = blockchain.last_block
 
     response = {
-        'last-block': result
+        'last-block': result,
+        'difficulty': DIFFICULTY,
     }
     return jsonify(response), 200
 
 
 # Run the program on port 5000
 if __name__ == '__main__':
+    # Where should the chain be stored?
+    if len(sys.argv) > 1:
+        data_dir = sys.argv[1]
+    else:
+        data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+    # Most bytes the mempool may take up, e.g. BLOCKCHAIN_MEMPOOL_BYTES=1048576
+    mempool = Mempool(int(os.environ.get('BLOCKCHAIN_MEMPOOL_BYTES', MAX_BYTES)))
+    blockchain = Blockchain(BlockStore(data_dir), mempool)
+    atexit.register(blockchain.save_checkpoint)
+    # SIGTERM would otherwise end the process without running atexit
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Log levels, e.g. BLOCKCHAIN_LOG='info,validation=debug'
+    configure_logging(os.environ.get('BLOCKCHAIN_LOG', 'info'))
+
     app.run(host='0.0.0.0', port=5000)
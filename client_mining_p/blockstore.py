@@ -0,0 +1,355 @@
+#
+# Dependencies
+#
+
+import os
+import json
+import hashlib
+import mmap
+import time
+import zlib
+import struct
+import weakref
+from array import array
+
+#
+# Define a sealed block
+#
+
+class Block(dict):
+    """
+    A Block that remembers its sorted JSON encoding and hash
+
+    Blocks never change once they are sealed, so the encoding is worked out
+    the first time it's needed and reused by every later hash and proof
+    check.  Don't modify a Block after reading either of them.
+    """
+
+    __slots__ = ('_encoded', '_hash')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._encoded = None
+        self._hash = None
+
+    @classmethod
+    def from_bytes(cls, encoded):
+        """
+        Decode a Block from its sorted JSON, keeping the bytes as its encoding
+
+        :param encoded: <bytes> The block as written by `json.dumps(block,
+        sort_keys=True).encode()`
+        :return: <Block>
+        """
+
+        block = cls(json.loads(encoded))
+        block._encoded = bytes(encoded)
+        return block
+
+    @property
+    def encoded(self):
+        """
+        <bytes> The sorted JSON the block is hashed and proven over
+        """
+
+        if self._encoded is None:
+            self._encoded = json.dumps(self, sort_keys=True).encode()
+        return self._encoded
+
+    @property
+    def hash(self):
+        """
+        <str> Hex SHA-256 of `encoded`
+        """
+
+        if self._hash is None:
+            self._hash = hashlib.sha256(self.encoded).hexdigest()
+        return self._hash
+
+#
+# Define an append-only block store
+#
+
+# Every record is a header holding the length and CRC-32 of its payload,
+# followed by the payload: one block as sorted JSON, the same bytes
+# `Block.hash` hashes.
+HEADER = struct.Struct('>II')
+
+# Start a new segment file once the current one reaches this many bytes
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Index entries pack the segment number above the byte offset
+OFFSET_BITS = 40
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+
+# When appended blocks are fsynced to disk:
+#   'always'   - before `append` returns
+#   'interval' - on the first append at least FSYNC_INTERVAL seconds after
+#                the last fsync, and on `close`
+#   'never'    - whenever the OS gets round to it
+FSYNC_POLICIES = ('always', 'interval', 'never')
+FSYNC_INTERVAL = 1.0
+
+
+class BlockStore(object):
+    """
+    Stores the chain as length-prefixed records in append-only segment files
+
+    Only the position of each record is kept in memory, eight bytes per
+    block.  Segments are memory-mapped and a block is decoded only when it
+    is asked for.  The store behaves like a list of blocks, so it can stand
+    in for `Blockchain.chain`.
+    """
+
+    def __init__(self, path, fsync='always', segment_size=SEGMENT_SIZE):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}")
+
+        self.path = path
+        self.fsync = fsync
+        self.segment_size = segment_size
+        self.last_sync = time.monotonic()
+
+        # Packed segment and offset of every record, in chain order
+        self.index = array('Q')
+        # Memory maps of the segments, by segment number, and the maps they
+        # replaced, which readers may still be using
+        self.maps = {}
+        self.retired = {}
+        # The most recently read tip, as (position, block)
+        self.tip = None
+        self.writer = None
+        self.segment = 0
+
+        os.makedirs(path, exist_ok=True)
+        self.recover()
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, f'{segment:08d}.seg')
+
+    def segments(self):
+        """
+        :return: <list> Numbers of the segment files on disk, in order
+        """
+
+        return sorted(int(name[:-4]) for name in os.listdir(self.path)
+                      if name.endswith('.seg') and name[:-4].isdigit())
+
+    def recover(self):
+        """
+        Rebuild the index from the segment files
+
+        Only record headers are read, skipping over the payloads, so this
+        costs one seek per block rather than a pass over the whole chain.
+        A torn record at the end of the last segment, left by a crash
+        part way through an append, is truncated away.
+        """
+
+        segments = self.segments()
+        for segment in segments:
+            path = self.segment_path(segment)
+            end = os.path.getsize(path)
+
+            with open(path, 'rb') as file:
+                offset = 0
+                while offset < end:
+                    header = file.read(HEADER.size)
+                    if len(header) < HEADER.size:
+                        break
+                    size, checksum = HEADER.unpack(header)
+                    if offset + HEADER.size + size > end:
+                        break
+                    self.index.append(segment << OFFSET_BITS | offset)
+                    offset += HEADER.size + size
+                    file.seek(offset)
+
+                # Appends are sequential, so only the very last record can
+                # be half written.  Its header may look fine while the
+                # payload is garbage, so check that one against its CRC.
+                if segment == segments[-1] and self.index and offset == end:
+                    last_segment, last_offset = self.locate(len(self.index) - 1)
+                    if last_segment == segment:
+                        file.seek(last_offset)
+                        size, checksum = HEADER.unpack(file.read(HEADER.size))
+                        if zlib.crc32(file.read(size)) != checksum:
+                            self.index.pop()
+                            offset = last_offset
+
+            if offset < end:
+                if segment != segments[-1]:
+                    raise IOError(f"Corrupt record in {path} at byte {offset}")
+                with open(path, 'r+b') as file:
+                    file.truncate(offset)
+
+        if segments:
+            self.segment = segments[-1]
+        self.writer = open(self.segment_path(self.segment), 'ab')
+
+    def append(self, block):
+        """
+        Append a block to the end of the store
+
+        :param block: <dict> Block
+        """
+
+        if isinstance(block, Block):
+            payload = block.encoded
+        else:
+            payload = json.dumps(block, sort_keys=True).encode()
+
+        if self.writer.tell() and self.writer.tell() + HEADER.size + len(payload) > self.segment_size:
+            self.sync()
+            self.writer.close()
+            self.segment += 1
+            self.writer = open(self.segment_path(self.segment), 'ab')
+
+        offset = self.writer.tell()
+        self.writer.write(HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self.writer.flush()
+
+        if self.fsync == 'always':
+            self.sync()
+        elif self.fsync == 'interval' and time.monotonic() - self.last_sync >= FSYNC_INTERVAL:
+            self.sync()
+
+        self.index.append(self.segment << OFFSET_BITS | offset)
+
+        # A sealed block can serve as the cached tip as it is
+        if isinstance(block, Block):
+            self.tip = (len(self.index) - 1, block)
+
+    def truncate(self, length):
+        """
+        Drop every block from position `length` onwards
+
+        :param length: <int> Number of blocks to keep
+        """
+
+        if length >= len(self.index):
+            return
+
+        segment, offset = self.locate(length)
+        del self.index[length:]
+        self.tip = None
+
+        self.writer.close()
+        for later in self.segments():
+            if later >= segment:
+                self.close_map(later)
+            if later > segment:
+                os.remove(self.segment_path(later))
+        with open(self.segment_path(segment), 'r+b') as file:
+            file.truncate(offset)
+            os.fsync(file.fileno())
+
+        self.segment = segment
+        self.writer = open(self.segment_path(segment), 'ab')
+
+    def locate(self, position):
+        """
+        :param position: <int> Position of the block in the chain, from 0
+        :return: <tuple> (segment, offset) of the block's record
+        """
+
+        entry = self.index[position]
+        return entry >> OFFSET_BITS, entry & OFFSET_MASK
+
+    def read_bytes(self, position):
+        """
+        Read one block's sorted JSON straight out of its segment's map
+
+        :param position: <int> Position of the block in the chain, from 0
+        :return: <bytes> The block's record payload
+        """
+
+        segment, offset = self.locate(position)
+
+        segment_map = self.maps.get(segment)
+        if segment_map is None or offset + HEADER.size > len(segment_map):
+            segment_map = self.open_map(segment)
+        size, checksum = HEADER.unpack_from(segment_map, offset)
+        start = offset + HEADER.size
+        if start + size > len(segment_map):
+            segment_map = self.open_map(segment)
+
+        return segment_map[start:start + size]
+
+    def read(self, position):
+        """
+        Read one block back from disk
+
+        The last block is asked for far more often than any other, so the
+        most recently read tip is kept decoded.
+        :param position: <int> Position of the block in the chain, from 0
+        :return: <dict> Block
+        """
+
+        tip = self.tip
+        if tip is not None and tip[0] == position:
+            return tip[1]
+
+        block = Block.from_bytes(self.read_bytes(position))
+        if position == len(self.index) - 1:
+            self.tip = (position, block)
+        return block
+
+    def open_map(self, segment):
+        """
+        (Re)map a segment, picking up anything appended since it was mapped
+
+        The map being replaced isn't closed, as other threads may still be
+        reading through it.  Appends never change the bytes it already
+        covers, so it stays good until the last of them lets go of it, or
+        the segment is truncated.
+        """
+
+        with open(self.segment_path(segment), 'rb') as file:
+            segment_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        replaced = self.maps.get(segment)
+        if replaced is not None:
+            self.retired.setdefault(segment, weakref.WeakSet()).add(replaced)
+        self.maps[segment] = segment_map
+        return segment_map
+
+    def sync(self):
+        os.fsync(self.writer.fileno())
+        self.last_sync = time.monotonic()
+
+    def close_map(self, segment):
+        """
+        Close a segment's maps, including any still held by readers, who
+        get a ValueError rather than read past the end of a truncated file
+        """
+
+        if segment in self.maps:
+            self.maps.pop(segment).close()
+        for segment_map in list(self.retired.pop(segment, ())):
+            segment_map.close()
+
+    def close(self):
+        self.sync()
+        self.writer.close()
+        for segment in set(self.maps) | set(self.retired):
+            self.close_map(segment)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self.read(i) for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError('block store index out of range')
+        return self.read(position)
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self.read(position)
+
+    def __delitem__(self, position):
+        if not isinstance(position, slice) or position.stop is not None or position.step is not None:
+            raise TypeError('only trailing blocks can be removed from a block store')
+        self.truncate(position.indices(len(self))[0])
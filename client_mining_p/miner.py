@@ -4,40 +4,231 @@
 
 import hashlib
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import time
 import sys
+import multiprocessing
 
 #
 # Define method to search for proof
 #
 
-def search_for_proof(block):
+# Number of leading zero bits the hash of a valid proof must have
+DIFFICULTY = 24
+
+
+def proof_target(difficulty=DIFFICULTY):
+    """
+    Precompute the difficulty check used by `valid_guess`
+
+    A hash has `difficulty` leading zero bits exactly when its first `size`
+    bytes, read as a big-endian integer, are less than `limit`.
+    :param difficulty: <int> Number of leading zero bits
+    :return: <tuple> (size, limit)
+    """
+
+    size = (difficulty + 7) // 8
+    return size, 1 << (size * 8 - difficulty)
+
+
+TARGET = proof_target()
+
+# Number of guesses handed to a backend per call, and so also how often a
+# worker checks the stop flag
+BATCH_SIZE = 10000
+
+
+def search_for_proof(block, workers=1, difficulty=DIFFICULTY, backend=None):
     """
     Simple Proof of Work Algorithm
-    Find a number p such that hash(last_block_string, p) contains 6 leading
-    zeroes
+    Find a number p such that hash(last_block_string, p) has `DIFFICULTY`
+    leading zero bits
+    :param block: <dict> The last block on the chain
+    :param workers: <int> Number of processes to search with
+    :param difficulty: <int> Number of leading zero bits the hash must have
+    :param backend: (Optional) <str> Name of the hashing backend to use
     :return: A valid proof for the provided block
     """
 
     block_string = json.dumps(block, sort_keys=True).encode()
-    
-    proof = 0
-    while valid_proof(block_string, proof) is False:
-        proof += 1
 
-    return proof
+    target = proof_target(difficulty)
+    backend = backend or DEFAULT_BACKEND
+
+    if workers > 1:
+        return parallel_search(block_string, workers, target, backend)
+
+    prefix = proof_prefix(block_string)
+    search_range = BACKENDS[backend]
+
+    start = 0
+    while True:
+        proof = search_range(prefix, start, BATCH_SIZE, target)
+        if proof is not None:
+            return proof
+        start += BATCH_SIZE
+
+
+def parallel_search(block_string, workers, target, backend):
+    """
+    Search for a proof across a pool of worker processes
+
+    The nonce space is cut into batches of `BATCH_SIZE` and dealt out round
+    robin, so worker n searches batches n, n + workers, n + 2 * workers, ...
+    and no two workers ever try the same proof.  The first worker to find a
+    valid proof records it and sets the shared stop flag, and the others
+    give up at the end of their current batch.
+    :param block_string: <bytes> The stringified last block
+    :param workers: <int> Number of processes to search with
+    :param target: <tuple> The result of `proof_target`
+    :param backend: <str> Name of the hashing backend to use
+    :return: A valid proof for the provided block
+    """
+
+    found = multiprocessing.Event()
+    result = multiprocessing.Value('q', -1)
 
+    pool = [
+        multiprocessing.Process(
+            target=search_batches,
+            args=(block_string, n, workers, target, backend, found, result),
+            daemon=True,
+        )
+        for n in range(workers)
+    ]
+    for process in pool:
+        process.start()
+
+    try:
+        while not found.wait(0.1):
+            if not any(process.is_alive() for process in pool):
+                raise RuntimeError("All proof of work workers have exited")
+    finally:
+        found.set()
+        for process in pool:
+            process.join()
+
+    return result.value
+
+
+def search_batches(block_string, worker, workers, target, backend, found, result):
+    """
+    Worker loop for `parallel_search`
 
-def valid_proof(block_string, proof):
-    guess = f'{block_string}{proof}'.encode()
-    guess_hash = hashlib.sha256(guess).hexdigest()
+    Checks the shared stop flag once per batch rather than once per guess,
+    so the workers stay out of each other's way.
+    """
 
-    # if guess_hash[:3] == "000":
-    #     print(f"guess: {guess}, guess_hash {guess_hash} | {guess_hash[:3]} == '000' #=> {guess_hash[:3] == '000'}")
+    prefix = proof_prefix(block_string)
+    search_range = BACKENDS[backend]
 
-    return guess_hash[:6] == "000000"
-    # return guess_hash[:3] == "000"
+    start = worker * BATCH_SIZE
+    while not found.is_set():
+        proof = search_range(prefix, start, BATCH_SIZE, target)
+        if proof is not None:
+            with result.get_lock():
+                if result.value < 0:
+                    result.value = proof
+            found.set()
+            return
+        start += workers * BATCH_SIZE
+
+
+#
+# Define hashing backends
+#
+# A backend is a function `search_range(prefix, start, count, target)` that
+# tries the proofs start, start + 1, ..., start + count - 1 in order and
+# returns the first valid one, or None.  Every backend must agree with
+# `valid_proof` on which proofs are valid.
+#
+
+def hashlib_search_range(prefix, start, count, target):
+    """
+    Pure hashlib backend
+    :param prefix: <hashlib hash> The result of `proof_prefix`
+    :param start: <int> First proof to try
+    :param count: <int> Number of proofs to try
+    :param target: <tuple> The result of `proof_target`
+    :return: <int> The first valid proof in the range, or None
+    """
+
+    size, limit = target
+    copy = prefix.copy
+    from_bytes = int.from_bytes
+
+    for proof in range(start, start + count):
+        guess_hash = copy()
+        guess_hash.update(b'%d' % proof)
+        if from_bytes(guess_hash.digest()[:size], 'big') < limit:
+            return proof
+
+    return None
+
+
+# Backends by name.  Only pure hashlib for now: without a compiled loop
+# around SHA-256, nothing else beats it.
+BACKENDS = {
+    'hashlib': hashlib_search_range,
+}
+
+DEFAULT_BACKEND = 'hashlib'
+
+
+def proof_prefix(block_string):
+    """
+    Hash the part of every guess that does not change
+
+    Each guess is `f'{block_string}{proof}'`, so the block string can be
+    hashed once and the hash state copied for every proof that is tried.
+    :param block_string: <bytes> The stringified block
+    :return: <hashlib hash> SHA-256 state after hashing the block string
+    """
+
+    return hashlib.sha256(f'{block_string}'.encode())
+
+
+def valid_guess(prefix, proof, target=TARGET):
+    """
+    Validates the Proof against a precomputed `proof_prefix`.  Gives the
+    same answer as `valid_proof(block_string, proof)` without re-hashing
+    the block string.
+    :param prefix: <hashlib hash> The result of `proof_prefix`
+    :param proof: <int?> The proof to check
+    :param target: <tuple> The result of `proof_target`
+    :return: True if the resulting hash is a valid proof, False otherwise
+    """
+
+    guess_hash = prefix.copy()
+    guess_hash.update(f'{proof}'.encode())
+
+    size, limit = target
+    return int.from_bytes(guess_hash.digest()[:size], 'big') < limit
+
+
+def valid_proof(block_string, proof, target=TARGET):
+    return valid_guess(proof_prefix(block_string), proof, target)
+
+
+#
+# Define connection to the node
+#
+
+def node_session(pool_size=2):
+    """
+    A `requests.Session` that keeps its connections to the node open
+
+    Every request would otherwise pay for a new TCP connection.
+    :param pool_size: <int> Most connections kept open at once
+    :return: <requests.Session>
+    """
+
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 
 #
@@ -51,20 +242,40 @@ if __name__ == '__main__':
     else:
         node = "http://localhost:5000"
 
+    # How many processes should search for proofs?
+    if len(sys.argv) > 2:
+        workers = int(sys.argv[2])
+    else:
+        workers = multiprocessing.cpu_count()
+
+    # Which hashing backend should the workers use?
+    if len(sys.argv) > 3:
+        backend = sys.argv[3]
+    else:
+        backend = DEFAULT_BACKEND
+
+    if backend not in BACKENDS:
+        print(f"Unknown backend {backend}, choose from {', '.join(BACKENDS)}")
+        sys.exit(1)
+
+    # Reuse one connection for every request to the node.
+    session = node_session(pool_size=1)
+
     coins_mined = 0
-    print("Mining has started.")
-    t1_start = time.process_time()
+    print(f"Mining has started with {workers} {backend} worker(s).")
+    t1_start = time.perf_counter()
     try:
         while True:
             # Get the last proof from the server and look for a new one.
-            res = requests.get(node + '/last-block')
+            res = session.get(node + '/last-block')
             res = json.loads(res.content)
+            difficulty = res.get('difficulty', DIFFICULTY)
 
             # We run the proof of work algorithm to get the next proof...
-            proof = search_for_proof(res['last-block'])
+            proof = search_for_proof(res['last-block'], workers, difficulty, backend)
 
             # When found, POST it to the server.
-            res = requests.post(node + '/mine', json={ "proof": proof })
+            res = session.post(node + '/mine', json={ "proof": proof })
             res_content = json.loads(res.content)
 
             # If the server responds with 'New Block Forged'.
@@ -75,5 +286,5 @@ if __name__ == '__main__':
                 print(res_content['message'])
     except Exception as e:
         print("Mining has ended.", e)
-        t1_stop = time.process_time()
+        t1_stop = time.perf_counter()
         print("Elapsed time: %.1f seconds" % ((t1_stop-t1_start)))
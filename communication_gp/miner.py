@@ -4,50 +4,245 @@
 
 import hashlib
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import time
 import sys
+import multiprocessing
+import threading
 
 #
 # Define method to search for proof
 #
 
-def search_for_proof(block):
+# Number of leading zero bits the hash of a valid proof must have
+DIFFICULTY = 12
+
+
+def proof_target(difficulty=DIFFICULTY):
+    """
+    Precompute the difficulty check used by `valid_guess`
+
+    A hash has `difficulty` leading zero bits exactly when its first `size`
+    bytes, read as a big-endian integer, are less than `limit`.
+    :param difficulty: <int> Number of leading zero bits
+    :return: <tuple> (size, limit)
+    """
+
+    size = (difficulty + 7) // 8
+    return size, 1 << (size * 8 - difficulty)
+
+
+TARGET = proof_target()
+
+# Number of guesses a worker makes between checks of the stop flag
+BATCH_SIZE = 10000
+
+# Longest time in seconds to hold a `/work` long-poll open
+WORK_TIMEOUT = 30
+
+# Seconds to wait before mining the same work again after `/mine` turns a
+# proof down
+RETRY_DELAY = 1
+
+
+def search_for_proof(block, workers=1, difficulty=DIFFICULTY, stale=None):
     """
     Simple Proof of Work Algorithm
-    Find a number p such that hash(last_block_string, p) contains 6 leading
-    zeroes
-    :return: A valid proof for the provided block
+    Find a number p such that hash(last_block_string, p) has `DIFFICULTY`
+    leading zero bits
+    :param block: <dict> The last block on the chain
+    :param workers: <int> Number of processes to search with
+    :param difficulty: <int> Number of leading zero bits the hash must have
+    :param stale: (Optional) <threading.Event> Set when `block` is no longer
+    the last block on the chain, checked between batches
+    :return: A valid proof for the provided block, or None if the search
+    was abandoned because `stale` was set
     """
 
     block_string = json.dumps(block, sort_keys=True).encode()
-    
+
+    target = proof_target(difficulty)
+
+    if workers > 1:
+        return parallel_search(block_string, workers, target, stale)
+
+    prefix = proof_prefix(block_string)
+
     proof = 0
-    while valid_proof(block_string, proof) is False:
-        proof += 1
+    while stale is None or not stale.is_set():
+        for _ in range(BATCH_SIZE):
+            if valid_guess(prefix, proof, target):
+                return proof
+            proof += 1
+
+    return None
+
+
+def parallel_search(block_string, workers, target, stale=None):
+    """
+    Search for a proof across a pool of worker processes
+
+    Worker n tries the proofs n, n + workers, n + 2 * workers, ... so the
+    nonce space is split into disjoint strides.  The first worker to find
+    a valid proof records it and sets the shared stop flag, and the others
+    give up at the end of their current batch.
+    :param block_string: <bytes> The stringified last block
+    :param workers: <int> Number of processes to search with
+    :param target: <tuple> The result of `proof_target`
+    :param stale: (Optional) <threading.Event> Abandons the search when set
+    :return: A valid proof for the provided block, or None if abandoned
+    """
+
+    found = multiprocessing.Event()
+    result = multiprocessing.Value('q', -1)
+
+    pool = [
+        multiprocessing.Process(
+            target=search_stride,
+            args=(block_string, n, workers, target, found, result),
+            daemon=True,
+        )
+        for n in range(workers)
+    ]
+    for process in pool:
+        process.start()
+
+    try:
+        while not found.wait(0.1):
+            if stale is not None and stale.is_set():
+                return None
+            if not any(process.is_alive() for process in pool):
+                raise RuntimeError("All proof of work workers have exited")
+    finally:
+        found.set()
+        for process in pool:
+            process.join()
+
+    return result.value
+
+
+def search_stride(block_string, start, step, target, found, result):
+    """
+    Worker loop for `parallel_search`
+
+    Checks the shared stop flag once per batch rather than once per guess,
+    so the workers stay out of each other's way.
+    """
+
+    prefix = proof_prefix(block_string)
+
+    proof = start
+    while not found.is_set():
+        for _ in range(BATCH_SIZE):
+            if valid_guess(prefix, proof, target):
+                with result.get_lock():
+                    if result.value < 0:
+                        result.value = proof
+                found.set()
+                return
+            proof += step
 
-    return proof
 
+def watch_for_work(session, node, work, new_work):
+    """
+    Keep a long-poll open on the node's `/work` endpoint
+
+    Whenever the node reports a last block other than the one we know
+    about, it is stored in `work['work']` and `new_work` is set, so the
+    search can drop the stale block straight away instead of finding out
+    from a rejected `/mine`.  If the node can't be reached the error is
+    stored in `work['error']` instead.
+    :param session: <requests.Session> Session to poll the node with
+    :param node: <str> The node to poll
+    :param work: <dict> Shared with the mining loop
+    :param new_work: <threading.Event> Set when `work` changes
+    """
+
+    known_hash = None
+    while True:
+        try:
+            res = session.get(node + '/work',
+                              params={'since': known_hash, 'timeout': WORK_TIMEOUT},
+                              timeout=WORK_TIMEOUT + 5)
+            res = json.loads(res.content)
+            latest = res['hash']
+        except (requests.RequestException, ValueError, KeyError) as e:
+            # Hand the error to the mining loop, which would otherwise wait
+            # for new work that is never coming
+            work['error'] = e
+            new_work.set()
+            return
+
+        if latest != known_hash:
+            known_hash = latest
+            work['work'] = res
+            new_work.set()
+
+
+def proof_prefix(block_string):
+    """
+    Hash the part of every guess that does not change
 
-def valid_proof(block_string, proof):
+    Each guess is `f'{block_string}{proof}'`, so the block string can be
+    hashed once and the hash state copied for every proof that is tried.
+    :param block_string: <bytes> The stringified block
+    :return: <hashlib hash> SHA-256 state after hashing the block string
     """
-    Validates the Proof:  Does hash(block_string, proof) contain 6
-    leading zeroes?  Return true if the proof is valid
+
+    return hashlib.sha256(f'{block_string}'.encode())
+
+
+def valid_guess(prefix, proof, target=TARGET):
+    """
+    Validates the Proof against a precomputed `proof_prefix`.  Gives the
+    same answer as `valid_proof(block_string, proof)` without re-hashing
+    the block string.
+    :param prefix: <hashlib hash> The result of `proof_prefix`
+    :param proof: <int?> The proof to check
+    :param target: <tuple> The result of `proof_target`
+    :return: True if the resulting hash is a valid proof, False otherwise
+    """
+
+    guess_hash = prefix.copy()
+    guess_hash.update(f'{proof}'.encode())
+
+    size, limit = target
+    return int.from_bytes(guess_hash.digest()[:size], 'big') < limit
+
+
+def valid_proof(block_string, proof, target=TARGET):
+    """
+    Validates the Proof:  Does hash(block_string, proof) have `DIFFICULTY`
+    leading zero bits?  Return true if the proof is valid
     :param block_string: <string> The stringified block to use to
     check in combination with `proof`
     :param proof: <int?> The value that when combined with the
     stringified previous block results in a hash that has the
-    correct number of leading zeroes.
+    correct number of leading zero bits.
     :return: True if the resulting hash is a valid proof, False otherwise
     """
-    guess = f'{block_string}{proof}'.encode()
-    guess_hash = hashlib.sha256(guess).hexdigest()
+    return valid_guess(proof_prefix(block_string), proof, target)
+
 
-    # if guess_hash[:3] == "000":
-    #     print(f"guess: {guess}, guess_hash {guess_hash} | {guess_hash[:3]} == '000' #=> {guess_hash[:3] == '000'}")
+#
+# Define connection to the node
+#
+
+def node_session(pool_size=2):
+    """
+    A `requests.Session` that keeps its connections to the node open
+
+    Every request would otherwise pay for a new TCP connection.
+    :param pool_size: <int> Most connections kept open at once
+    :return: <requests.Session>
+    """
 
-    # return guess_hash[:6] == "000000"
-    return guess_hash[:3] == "000"
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 
 #
@@ -61,29 +256,64 @@ if __name__ == '__main__':
     else:
         node = "http://localhost:5000"
 
+    # How many processes should search for proofs?
+    if len(sys.argv) > 2:
+        workers = int(sys.argv[2])
+    else:
+        workers = multiprocessing.cpu_count()
+
     coins_mined = 0
-    print("Mining has started.")
-    t1_start = time.process_time()
+    print(f"Mining has started with {workers} worker(s).")
+    t1_start = time.perf_counter()
+
+    # The long-poll and the proof submissions each keep a connection open.
+    session = node_session(pool_size=2)
+
+    # Follow the node's tip in the background.
+    work = {}
+    new_work = threading.Event()
+    watcher = threading.Thread(target=watch_for_work,
+                               args=(session, node, work, new_work),
+                               daemon=True)
+    watcher.start()
+
     try:
+        new_work.wait()
         while True:
-            # Get the last proof from the server and look for a new one.
-            res = requests.get(node + '/last-block')
-            res = json.loads(res.content)
+            if 'error' in work:
+                raise work['error']
+
+            # Mine on the latest block the node has told us about.
+            new_work.clear()
+            res = work['work']
+            difficulty = res.get('difficulty', DIFFICULTY)
 
             # We run the proof of work algorithm to get the next proof...
-            proof = search_for_proof(res['last-block'])
+            proof = search_for_proof(res['last-block'], workers, difficulty, new_work)
+            if proof is None:
+                print("New block on the chain, restarting search.")
+                continue
 
             # When found, POST it to the server.
-            res = requests.post(node + '/mine', json={ "proof": proof })
-            res_content = json.loads(res.content)
+            res = session.post(node + '/mine', json={ "proof": proof })
+            try:
+                message = json.loads(res.content)['message']
+            except (ValueError, KeyError, TypeError):
+                message = f"Node answered {res.status_code}"
 
             # If the server responds with 'New Block Forged'.
-            if res.status_code == 200 and res_content['message'] == 'New Block Forged':
+            if res.status_code == 200 and message == 'New Block Forged':
                 coins_mined += 1
                 print(f"Total Coins Mined: {coins_mined}")
+
+                # Give the node a moment to announce the block we just mined.
+                new_work.wait(WORK_TIMEOUT)
             else:
-                print(res_content['message'])
+                # The tip may not move, so rather than wait for new work that
+                # never comes, mine the current work again after a pause
+                print(message)
+                new_work.wait(RETRY_DELAY)
     except Exception as e:
         print("Mining has ended.", e)
-        t1_stop = time.process_time()
+        t1_stop = time.perf_counter()
         print("Elapsed time: %.1f seconds" % ((t1_stop-t1_start)))
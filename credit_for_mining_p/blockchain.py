@@ -2,26 +2,303 @@
 # Dependencies
 #
 
+import os
 import sys
 import json
+import math
+import atexit
+import logging
+import signal
 import hashlib
 import requests
-from time import time
+import threading
+from bisect import bisect_left
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from time import time, monotonic, perf_counter
 from uuid import uuid4
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from urllib.parse import urlparse
+from blockstore import Block, BlockStore
+from mempool import MAX_BYTES, Mempool, TransactionRejected, make_transaction, transaction_id
+from peers import PeerSessions
+
+#
+# Define logging
+#
+
+# Each subsystem logs to its own `blockchain.<subsystem>` logger, so its
+# level can be set on its own
+validation_log = logging.getLogger('blockchain.validation')
+mining_log = logging.getLogger('blockchain.mining')
+broadcast_log = logging.getLogger('blockchain.broadcast')
+consensus_log = logging.getLogger('blockchain.consensus')
+
+
+def configure_logging(spec):
+    """
+    Set log levels from a spec such as 'info,validation=debug,mining=off'
+
+    A bare level applies to every subsystem, and `subsystem=level` sets one
+    subsystem.  Per-block traces are logged at debug level.
+    :param spec: <str> Comma separated levels
+    """
+
+    logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s: %(message)s')
+    logging.getLogger('blockchain').setLevel(logging.INFO)
+
+    for part in spec.split(','):
+        subsystem, _, level = part.strip().rpartition('=')
+        if not level:
+            continue
+        logger = logging.getLogger('blockchain' + (f'.{subsystem}' if subsystem else ''))
+        if level.lower() == 'off':
+            logger.setLevel(logging.CRITICAL + 1)
+        else:
+            logger.setLevel(level.upper())
 
 #
 # Define data structure
 #
 
+# Number of leading zero bits the hash of a valid proof must have
+DIFFICULTY = 12
+
+
+def proof_target(difficulty=DIFFICULTY):
+    """
+    Precompute the difficulty check used by `valid_guess`
+
+    A hash has `difficulty` leading zero bits exactly when its first `size`
+    bytes, read as a big-endian integer, are less than `limit`.
+    :param difficulty: <int> Number of leading zero bits
+    :return: <tuple> (size, limit)
+    """
+
+    size = (difficulty + 7) // 8
+    return size, 1 << (size * 8 - difficulty)
+
+
+TARGET = proof_target()
+
+# Most transactions a new block takes from the mempool
+BLOCK_TRANSACTIONS = 1000
+
+# Coins the miner of a block is paid, by the block's one transaction from
+# "0".  No one else may send from "0".
+MINING_REWARD = 1
+
+# The fields of a block, with their types, and of a transaction, which may
+# also have a nonce
+BLOCK_FIELDS = {
+    'index': int,
+    'timestamp': (int, float),
+    'transactions': list,
+    'proof': int,
+    'previous_hash': str,
+}
+TRANSACTION_FIELDS = {'sender', 'recipient', 'amount'}
+TRANSACTION_OPTIONAL = {'nonce'}
+
+# Every block takes the same expected number of hashes to mine at a fixed
+# DIFFICULTY, so a branch's cumulative work is its length times this
+BLOCK_WORK = 2 ** DIFFICULTY
+
+# Side branches forking off more than this many blocks below our last block
+# are dropped
+MAX_FORK_DEPTH = 100
+
+# Blocks whose parent we haven't seen are held until it arrives, up to this
+# many, dropping the oldest first
+MAX_ORPHANS = 100
+
+# An orphan more than this many blocks past our last block means we have
+# fallen behind, rather than that blocks arrived out of order
+ORPHAN_LOOKAHEAD = 3
+
+# Longest time in seconds a `/work` long-poll is held open
+WORK_TIMEOUT = 30
+
+# Chains with at least this many blocks to check are verified across a
+# process pool, split into about this many shards per worker
+PARALLEL_VERIFY_MIN = 2000
+SHARDS_PER_WORKER = 4
+
+# New blocks are sent to peers from a pool of this many threads, and each
+# peer gets this many seconds to answer
+BROADCAST_WORKERS = 8
+BROADCAST_TIMEOUT = 5
+
+# Consensus asks every peer for its height from a pool of this many
+# threads, waiting CONSENSUS_TIMEOUT seconds for them.  Each request made
+# while syncing gets as long again.
+CONSENSUS_WORKERS = 8
+CONSENSUS_TIMEOUT = 10
+
+# A round of consensus starts no new batch of blocks after this many
+# seconds.  Batches are applied as they arrive, so the next round carries
+# on from wherever this one stopped.
+SYNC_TIMEOUT = 60
+
+# Headers and blocks are synced this many at a time, which is no more
+# than a peer sends in one page
+SYNC_BATCH_SIZE = 100
+
+# The transaction indexes and balances, and the verified checkpoint, are
+# saved to this file, next to the block store's segments, every
+# INDEX_SAVE_INTERVAL blocks and when the node shuts down
+INDEX_FILE = 'indexes.json'
+INDEX_SAVE_INTERVAL = 100
+
+
+class ChainChanged(Exception):
+    """
+    Raised when a snapshot's blocks are rolled back while it is being read
+    """
+
+
+class ChainSnapshot(object):
+    """
+    A read-only view of the chain as it was when the snapshot was taken
+
+    Blocks are only ever appended to the chain, except when a
+    reorganization rolls some back, and that bumps `Blockchain.reorgs`
+    first.  So a snapshot reads the chain without taking any lock: it
+    covers the blocks that were there when it was taken, and raises
+    ChainChanged if a reorganization has happened since, rather than mix
+    in blocks from another branch.
+    """
+
+    def __init__(self, blockchain):
+        self.blockchain = blockchain
+        self.chain = blockchain.chain
+        self.reorgs = blockchain.reorgs
+        self.length = len(self.chain)
+
+    def check(self):
+        if self.blockchain.reorgs != self.reorgs:
+            raise ChainChanged('The chain was reorganized while it was being read')
+
+    def read_bytes(self, position):
+        """
+        :param position: <int> Position of the block in the chain, from 0
+        :return: <bytes> The block's sorted JSON
+        """
+
+        try:
+            if isinstance(self.chain, BlockStore):
+                encoded = self.chain.read_bytes(position)
+            else:
+                encoded = Blockchain.encode(self.chain[position])
+        except (IndexError, ValueError):
+            # Rolled back under us, and its segment's maps closed with it
+            self.check()
+            raise
+        self.check()
+        return encoded
+
+    def read(self, position):
+        try:
+            block = self.chain[position]
+        except (IndexError, ValueError):
+            self.check()
+            raise
+        self.check()
+        return block
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self.read(i) for i in range(*position.indices(self.length))]
+        if position < 0:
+            position += self.length
+        if not 0 <= position < self.length:
+            raise IndexError('chain snapshot index out of range')
+        return self.read(position)
+
+    def __iter__(self):
+        for position in range(self.length):
+            yield self.read(position)
+
+
 class Blockchain(object):
-    def __init__(self):
-        self.chain = []
-        self.current_transactions = []
+    def __init__(self, store=None, mempool=None):
+        # Blocks live in `store` when one is given, otherwise in memory
+        self.chain = store if store is not None else []
+        # Transactions waiting to go into a block.  The mempool has a lock of
+        # its own, so adding a transaction never waits on the chain.  When
+        # both are needed, take `chain_lock` first.
+        self.mempool = mempool if mempool is not None else Mempool()
+        # Replaced rather than changed in place, so it can be iterated
+        # without a lock
         self.nodes = set()
 
-        self.create_genesis_block()
+        # Blocks on side branches of the block tree, as (block, cumulative
+        # work) by hash.  Blocks on our chain are looked up by index.
+        self.side_blocks = {}
+
+        # Everything that changes the chain holds `chain_lock`, so each
+        # change is applied whole or not at all.  Readers take no lock: they
+        # read the published `tip`, and take snapshots, which `reorgs` tells
+        # when blocks have been rolled back under them.
+        self.chain_lock = threading.RLock()
+        self.reorgs = 0
+        self.tip = None
+
+        # Held while `nodes` is replaced, so two nodes registering at once
+        # can't drop one another
+        self.nodes_lock = threading.Lock()
+
+        # Where each confirmed transaction is, as (block index, position in
+        # the block), listed in chain order by address and by transaction
+        # id.  Identical transactions share an id, so an id can have
+        # several locations.
+        self.address_index = {}
+        self.tx_index = {}
+
+        # Confirmed balance of every address that has sent or received
+        # coins, kept up to date as blocks are added and rolled back.
+        # `spend_lock` is held while checking a spend against it and the
+        # mempool, and while either changes; take it after `chain_lock`.
+        self.balances = {}
+        self.spend_lock = threading.Lock()
+
+        # Blocks whose parent we haven't seen yet, by hash in the order they
+        # arrived, and their hashes by their parent's hash
+        self.orphans = OrderedDict()
+        self.orphans_by_parent = {}
+
+        # The URL peers reach this node at, sent along with our blocks
+        self.address = None
+        # Keep-alive connections to each peer, shared by broadcast and
+        # consensus
+        self.peers = PeerSessions()
+        self.broadcast_pool = ThreadPoolExecutor(max_workers=BROADCAST_WORKERS,
+                                                 thread_name_prefix='broadcast')
+        self.consensus_pool = ThreadPoolExecutor(max_workers=CONSENSUS_WORKERS,
+                                                 thread_name_prefix='consensus')
+        self.consensus_lock = threading.Lock()
+        # Periodic saves of the indexes are written from here, one at a time
+        self.save_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='save')
+
+        # How many blocks at the start of the chain are known to be valid,
+        # and the hash of the last of them
+        self.verified_height = 0
+        self.verified_hash = None
+
+        # Length of the chain when the indexes were last saved, or loaded
+        self.saved_height = 0
+
+        # Notified whenever the last block changes
+        self.tip_changed = threading.Condition()
+
+        if not self.chain:
+            self.create_genesis_block()
+        self.tip = self.chain[-1]
+
+        self.load_indexes()
 
     def create_genesis_block(self):
         """
@@ -30,13 +307,13 @@ class Blockchain(object):
         These are hardcoded into _most_ if not all blockchain protocols
         """
 
-        block = {
+        block = Block({
             'index': 1,
             'timestamp': 1,
             'transactions': [],
             'proof': 1,
             'previous_hash': 1,
-        }
+        })
 
         self.chain.append(block)
 
@@ -49,41 +326,332 @@ class Blockchain(object):
         :return: <dict> New Block
         """
 
-        block = {
-            'index': len(self.chain) + 1,
-            'timestamp': time(),
-            'transactions': self.current_transactions,
-            'proof': proof,
-            'previous_hash': previous_hash or self.hash(self.chain[-1]),
-        }
-
-        # Reset the current list of transactions
-        self.current_transactions = []
-
-        self.chain.append(block)
+        with self.chain_lock, self.spend_lock:
+            block = Block({
+                'index': len(self.chain) + 1,
+                'timestamp': time(),
+                'transactions': self.affordable(self.mempool.take(BLOCK_TRANSACTIONS)),
+                'proof': proof,
+                'previous_hash': previous_hash or self.hash(self.chain[-1]),
+            })
+
+            self.chain.append(block)
+            self.tip = block
+            self.apply_balances(block)
+            self.index_transactions(block)
+            self.advance_checkpoint()
+            self.prune_forks()
+        self.notify_new_tip()
         return block
 
-    def new_transaction(self, sender, recipient, amount):
+    def new_transaction(self, sender, recipient, amount, nonce=None):
         """
         Creates a new transaction to go into the next mined Block
 
         :param sender: <str> Address of the Recipient
         :param recipient: <str> Address of the Recipient
         :param amount: <int> Amount
+        :param nonce: (Optional) <str> or <int> Tells apart transactions that
+        are otherwise the same
         :return: <int> The index of the BLock that will hold this transaction
+        :raise TransactionRejected: If the sender can't afford it, it is a
+        repeat, or the mempool won't take it
         """
 
-        self.current_transactions.append({
-            'sender': sender,
-            'recipient': recipient,
-            'amount': amount,
-        })
+        tx_id = self.new_transactions([make_transaction(sender, recipient, amount, nonce)])[0]
+        if isinstance(tx_id, TransactionRejected):
+            raise tx_id
 
         return self.last_block['index'] + 1
 
+    def new_transactions(self, transactions):
+        """
+        Creates a batch of transactions to go into the next mined Blocks
+
+        Each spend is checked against what its sender has left after their
+        transactions already waiting and those earlier in the batch.  Then
+        the whole batch goes into the mempool in one go.
+        :param transactions: <list> Dicts with the same `sender`, `recipient`,
+        `amount` and optional `nonce` that `new_transaction` takes
+        :return: <list> For each transaction, its id if it was accepted, or
+        the TransactionRejected saying why not
+        """
+
+        results = [None] * len(transactions)
+        affordable = []
+
+        with self.spend_lock:
+            spendable = {}
+            for position, values in enumerate(transactions):
+                sender, amount = values['sender'], values['amount']
+                tx = make_transaction(sender, values['recipient'], amount, values.get('nonce'))
+                if not valid_amount(amount):
+                    results[position] = TransactionRejected('Invalid Amount')
+                    continue
+
+                # Only `new_reward` mints coins
+                if sender == '0':
+                    results[position] = TransactionRejected('Invalid Sender')
+                    continue
+                if self.confirmed(tx):
+                    results[position] = TransactionRejected('Duplicate Transaction')
+                    continue
+
+                if sender not in spendable:
+                    spendable[sender] = self.spendable(sender)
+                if amount > spendable[sender]:
+                    results[position] = TransactionRejected('Insufficient Funds')
+                    continue
+                spendable[sender] -= amount
+                affordable.append((position, tx))
+
+            ids = self.mempool.add_many([tx for position, tx in affordable])
+
+        for (position, tx), tx_id in zip(affordable, ids):
+            results[position] = tx_id
+        return results
+
+    def new_reward(self, recipient):
+        """
+        Pay the miner of the next Block its MINING_REWARD
+
+        The reward comes from "0" and creates coins rather than spending
+        them, so it skips the checks `new_transactions` makes.
+        :param recipient: <str> Address of the miner
+        """
+
+        # A fresh nonce, so no two rewards are ever the same transaction
+        self.mempool.add(make_transaction('0', recipient, MINING_REWARD, uuid4().hex))
+
+    def spendable(self, address):
+        """
+        :param address: <str> An address
+        :return: <int> Its confirmed balance, less what it is spending in
+        transactions still waiting in the mempool
+        """
+
+        pending = sum(tx['amount'] for tx in self.mempool.from_sender(address))
+        return self.balances.get(address, 0) - pending
+
+    def confirmed(self, tx):
+        """
+        A transaction with a nonce is meant to happen once, so one already on
+        our chain is a repeat.  Without a nonce, identical transactions are
+        separate payments once the first is confirmed.
+
+        :param tx: <dict> Transaction
+        :return: <bool> True if `tx` has a nonce and is already on our chain
+        """
+
+        return tx.get('nonce') is not None and transaction_id(tx) in self.tx_index
+
+    def index_path(self):
+        """
+        :return: <str> Where the indexes and balances are saved, or None when the chain
+        is only kept in memory
+        """
+
+        if isinstance(self.chain, BlockStore):
+            return os.path.join(self.chain.path, INDEX_FILE)
+        return None
+
+    def load_indexes(self):
+        """
+        Build the transaction indexes and balances for the blocks already on our chain
+
+        They are read back from where `save_indexes` left them, as long as
+        the block they were saved at is still on our chain, and only blocks
+        added since are decoded.  Otherwise, such as after a crash rolled
+        back past that block, every block is.  The verified checkpoint is
+        picked up along with them, so a restart doesn't check the whole
+        chain again.
+        """
+
+        height = 0
+        saved = None
+        path = self.index_path()
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as file:
+                    saved = json.load(file)
+            except (OSError, ValueError) as e:
+                validation_log.warning('Ignoring unreadable %s: %s', path, e)
+
+        if saved is not None and 0 < saved['height'] <= len(self.chain) \
+                and self.hash(self.chain[saved['height'] - 1]) == saved['hash']:
+            height = saved['height']
+            # JSON has no tuples, and locations have to compare as tuples
+            self.address_index = {address: [tuple(location) for location in locations]
+                                  for address, locations in saved['address_index'].items()}
+            self.tx_index = {tx_id: [tuple(location) for location in locations]
+                             for tx_id, locations in saved['tx_index'].items()}
+            # Older files have no checkpoint
+            self.verified_height = saved.get('verified_height', 0)
+            self.verified_hash = saved.get('verified_hash')
+            self.balances = saved['balances']
+        self.saved_height = height
+
+        for position in range(height, len(self.chain)):
+            block = self.chain[position]
+            self.apply_balances(block)
+            self.index_transactions(block)
+
+    def save_indexes(self):
+        """
+        Write the transaction indexes and balances, and the verified
+        checkpoint, next to the block store, for `load_indexes` to pick up
+        from on the next start
+        """
+
+        path = self.index_path()
+        if path is None:
+            return
+
+        with self.chain_lock, self.spend_lock:
+            self.saved_height = len(self.chain)
+            saved = json.dumps({
+                'height': len(self.chain),
+                'hash': self.hash(self.last_block),
+                'address_index': self.address_index,
+                'tx_index': self.tx_index,
+                'verified_height': self.verified_height,
+                'verified_hash': self.verified_hash,
+                'balances': self.balances,
+            })
+
+        # Written aside and moved into place, so a crash part way through
+        # leaves the last good file
+        with open(path + '.tmp', 'w') as file:
+            file.write(saved)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + '.tmp', path)
+
+    def index_transactions(self, block):
+        """
+        Add a block's transactions to `address_index` and `tx_index`
+
+        :param block: <dict> Block just added to our chain
+        """
+
+        for position, tx in enumerate(block['transactions']):
+            location = (block['index'], position)
+            # "0" is where mining rewards come from, not an address
+            for address in {tx['sender'], tx['recipient']} - {'0'}:
+                self.address_index.setdefault(address, []).append(location)
+            self.tx_index.setdefault(transaction_id(tx), []).append(location)
+
+    def unindex_transactions(self, block):
+        """
+        Take a block's transactions back out of `address_index` and
+        `tx_index`
+
+        Blocks are rolled back last first, so the block's locations are the
+        last ones in every list they are in.
+        :param block: <dict> Block being rolled back from our chain
+        """
+
+        for tx in reversed(block['transactions']):
+            for address in {tx['sender'], tx['recipient']} - {'0'}:
+                self.drop_last_location(self.address_index, address)
+            self.drop_last_location(self.tx_index, transaction_id(tx))
+
+    @staticmethod
+    def drop_last_location(index, key):
+        """
+        Pop the last location listed under `key`, and `key` with it once none
+        are left
+        """
+
+        locations = index[key]
+        locations.pop()
+        if not locations:
+            del index[key]
+
+    def affordable(self, transactions):
+        """
+        Drop the transactions whose senders can no longer afford them
+
+        A spend is checked against its sender's balance when it arrives, but
+        a reorganization can take away the coins it was checked against.
+        Only the first mining reward is kept, as a block may pay just one.
+        :param transactions: <list> Transactions taken from the mempool
+        :return: <list> Those that confirmed balances still cover, in order
+        """
+
+        spent = {}
+        kept = []
+        rewarded = False
+        for tx in transactions:
+            sender, amount = tx['sender'], tx['amount']
+            if sender == '0':
+                if rewarded:
+                    continue
+                rewarded = True
+            else:
+                if self.balances.get(sender, 0) - spent.get(sender, 0) < amount:
+                    mining_log.info('Dropped a spend of %s from %s, who can no longer afford it',
+                                    amount, sender)
+                    continue
+                spent[sender] = spent.get(sender, 0) + amount
+            kept.append(tx)
+        return kept
+
+    def valid_spends(self, start, blocks):
+        """
+        Check that no transaction in `blocks` spends more than its sender has
+
+        Balances are worked out as they would be with only our first `start`
+        blocks, then every transaction is checked in order, so coins can't
+        be spent before they arrive.
+        :param start: <int> Number of our blocks `blocks` would follow
+        :param blocks: <list> Blocks
+        :return: <bool> True if every spend is covered, False if not
+        """
+
+        # What rolling back our blocks after `start` would add to each
+        # balance, then what `blocks` would
+        changes = {}
+        for block in self.chain[start:]:
+            for tx in block['transactions']:
+                if tx['sender'] != '0':
+                    changes[tx['sender']] = changes.get(tx['sender'], 0) + tx['amount']
+                changes[tx['recipient']] = changes.get(tx['recipient'], 0) - tx['amount']
+
+        for block in blocks:
+            for tx in block['transactions']:
+                sender, amount = tx['sender'], tx['amount']
+                if sender != '0':
+                    if self.balances.get(sender, 0) + changes.get(sender, 0) < amount:
+                        validation_log.warning('Block %d spends more than %s has',
+                                               block['index'], sender)
+                        return False
+                    changes[sender] = changes.get(sender, 0) - amount
+                changes[tx['recipient']] = changes.get(tx['recipient'], 0) + amount
+
+        return True
+
+    def apply_balances(self, block, sign=1):
+        """
+        Move the amount of each of a block's transactions from its sender
+        to its recipient, or back again when `sign` is -1
+
+        :param block: <dict> Block being added to, or rolled back from, our
+        chain
+        :param sign: (Optional) <int> 1 to apply the block, -1 to undo it
+        """
+
+        balances = self.balances
+        for tx in block['transactions']:
+            amount = sign * tx['amount']
+            if tx['sender'] != '0':
+                balances[tx['sender']] = balances.get(tx['sender'], 0) - amount
+            balances[tx['recipient']] = balances.get(tx['recipient'], 0) + amount
+
     def register_node(self, node):
         parsed_url = urlparse(node)
-        self.nodes.add(parsed_url.netloc)
+        with self.nodes_lock:
+            self.nodes = self.nodes | {parsed_url.netloc}
 
     def verify_node(self, node):
         parsed_url = urlparse(node)
@@ -93,14 +661,416 @@ class Blockchain(object):
         """
         Alert neighbors that a new block has been mined and they should add it to their chain
         as well
+
+        Each neighbor is sent the block from the broadcast thread pool, so
+        this returns straight away and a slow or dead peer can't hold up the
+        others, or the caller.
+        :param block: <dict> Block
+        :return: <list> A future per neighbor, resolving to the status code it
+        answered with, or None if it couldn't be reached
+        """
+
+        neighbors = list(self.nodes)
+
+        post_data = {"block": block, "node": self.address}
+
+        return [self.broadcast_pool.submit(self.send_block, node, post_data)
+                for node in neighbors]
+
+    def send_block(self, node, post_data):
+        """
+        POST a block to one neighbor, giving up after BROADCAST_TIMEOUT seconds
+
+        :param node: <str> The neighbor's address
+        :param post_data: <dict> The body to send
+        :return: <int> The status code it answered with, or None
+        """
+
+        broadcast_log.debug('POST http://%s/block/new %s', node, post_data)
+        try:
+            response = self.peers.post(node, '/block/new', json=post_data,
+                                       timeout=BROADCAST_TIMEOUT)
+        except requests.RequestException as e:
+            broadcast_log.warning('Could not send block %d to %s: %s',
+                                  post_data['block']['index'], node, e)
+            return None
+
+        broadcast_log.debug('%s answered %d', node, response.status_code)
+        return response.status_code
+
+    def resolve_conflicts(self):
+        """
+        Consensus: replace our chain with the tallest valid chain among our
+        peers
+
+        Every peer is asked for its height at once, and those that haven't
+        answered after CONSENSUS_TIMEOUT seconds are left out.  We then sync
+        from the tallest peer, falling back to the next tallest if its
+        blocks turn out to be invalid, until SYNC_TIMEOUT runs out.  Only
+        one round runs at a time.
+        :return: <bool> True if our chain was changed, False if not
+        """
+
+        if not self.consensus_lock.acquire(blocking=False):
+            consensus_log.debug('Consensus already in progress')
+            return False
+
+        try:
+            sync_deadline = monotonic() + SYNC_TIMEOUT
+            deadline = monotonic() + CONSENSUS_TIMEOUT
+
+            polls = {self.consensus_pool.submit(self.poll_height, node, deadline): node
+                     for node in list(self.nodes)}
+            done, not_done = wait(polls, timeout=deadline - monotonic())
+            for future in not_done:
+                future.cancel()
+
+            our_height = len(self.chain)
+            heights = {polls[future]: future.result() for future in done
+                       if future.result() is not None}
+            consensus_log.debug('Peer heights: %s', heights)
+
+            for node in sorted(heights, key=heights.get, reverse=True):
+                if heights[node] <= our_height:
+                    break
+                if monotonic() >= sync_deadline:
+                    break
+                if self.sync_from(node, heights, sync_deadline):
+                    return True
+
+            return False
+        finally:
+            self.consensus_lock.release()
+
+    def poll_height(self, node, deadline):
+        """
+        :param node: <str> The peer's address
+        :param deadline: <float> `time.monotonic()` to give up at
+        :return: <int> Number of blocks in the peer's chain, or None if it
+        couldn't be reached in time
+        """
+
+        try:
+            response = self.peers.get(node, '/last-block',
+                                      timeout=max(deadline - monotonic(), 0.001))
+            return response.json()['last-block']['index']
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            consensus_log.warning('Could not get the height of %s: %s', node, e)
+            return None
+
+    def sync_from(self, node, heights, deadline=None):
+        """
+        Headers-first sync: catch up with `node`, downloading only the
+        blocks we are missing
+
+        The peer's headers are fetched first, going back from our tip until
+        one of them matches a block of ours, which is where the chains fork.
+        The blocks after the fork are then downloaded in batches, spread
+        across every peer tall enough to have them, and each block is
+        checked against its header's hash.  Batches are applied as they
+        arrive.  The peer's blocks are only held back until its branch is
+        longer than ours, when they replace ours from the fork on, and the
+        rest are ingested through `add_blocks`.  So a sync that is cut short
+        keeps what it got.
+        :param node: <str> The peer to follow
+        :param heights: <dict> Heights of the peers that answered, by peer
+        :param deadline: (Optional) <float> `time.monotonic()` after which
+        no more batches are applied
+        :return: <bool> True if our chain was changed, False if not
+        """
+
+        height = heights[node]
+        our_height = len(self.chain)
+
+        # Look back a little way from our tip first, and twice as far every
+        # time the oldest header fetched is still past the fork
+        lookback = SYNC_BATCH_SIZE
+        start = max(1, our_height - lookback + 1)
+        headers = self.fetch_headers(node, start, height)
+        while headers and start > 1 and headers[0]['hash'] != self.hash(self.chain[start - 1]):
+            lookback *= 2
+            earlier = max(1, start - lookback)
+            older = self.fetch_headers(node, earlier, start - 1)
+            if older is None:
+                return False
+            headers = older + headers
+            start = earlier
+        if not headers:
+            return False
+
+        # Our last block that the peer also has
+        fork = start - 1
+        for header in headers:
+            if header['index'] > our_height or header['hash'] != self.hash(self.chain[header['index'] - 1]):
+                break
+            fork = header['index']
+
+        # Every chain starts from the same hardcoded genesis block, so a peer
+        # without ours shares no history with us to build on
+        if not fork:
+            consensus_log.warning('%s does not share our genesis block', node)
+            return False
+
+        missing = headers[fork - start + 1:]
+        if fork + len(missing) <= our_height:
+            return False
+
+        # The peer's headers have to form a chain of their own
+        fork_hash = previous_hash = self.hash(self.chain[fork - 1])
+        for header in missing:
+            if header['previous_hash'] != previous_hash:
+                consensus_log.warning('Headers from %s do not link up at block %d',
+                                      node, header['index'])
+                return False
+            previous_hash = header['hash']
+
+        consensus_log.info('Fetching blocks %d to %d from %s',
+                           fork + 1, fork + len(missing), node)
+
+        batches = [missing[i:i + SYNC_BATCH_SIZE]
+                   for i in range(0, len(missing), SYNC_BATCH_SIZE)]
+
+        def download(number):
+            # Each batch comes from a peer tall enough to have all of it
+            batch = batches[number]
+            sources = sorted(peer for peer, peer_height in heights.items()
+                             if peer_height >= batch[-1]['index'])
+            return self.consensus_pool.submit(self.fetch_blocks,
+                                              sources[number % len(sources)], batch)
+
+        # Keep a few batches downloading ahead of the one being applied
+        downloads = deque(download(number)
+                          for number in range(min(CONSENSUS_WORKERS, len(batches))))
+        # The peer's blocks after the fork, held back until its branch is
+        # longer than ours, then None once they have replaced ours
+        branch = []
+        changed = False
+        try:
+            for number, batch in enumerate(batches):
+                if deadline is not None and monotonic() >= deadline:
+                    consensus_log.info('Sync from %s ran out of time before block %d',
+                                       node, batch[0]['index'])
+                    break
+
+                blocks = downloads.popleft().result()
+                if number + CONSENSUS_WORKERS < len(batches):
+                    downloads.append(download(number + CONSENSUS_WORKERS))
+
+                # Fall back to `node` itself
+                if blocks is None:
+                    blocks = self.fetch_blocks(node, batch)
+                if blocks is None:
+                    break
+
+                # Once the peer's branch is ours, the rest go through the
+                # same checks as blocks sent to us one at a time
+                if branch is None:
+                    statuses = self.add_blocks(blocks)
+                    if not all(status in ('extended', 'reorganized', 'side', 'known')
+                               for status in statuses):
+                        consensus_log.warning('Rejected blocks %d to %d from %s: %s',
+                                              batch[0]['index'], batch[-1]['index'],
+                                              node, statuses)
+                        break
+                    continue
+
+                # Check the new blocks are well formed and numbered on from
+                # the ones they build on, then that they link up to them
+                first = fork + len(branch) + 1
+                if not all(self.valid_structure(block) and block['index'] == first + offset
+                           for offset, block in enumerate(blocks)):
+                    consensus_log.warning('Rejected malformed blocks from %s', node)
+                    break
+                parent = branch[-1] if branch else self.chain[fork - 1]
+                if not self.valid_chain([parent] + blocks):
+                    consensus_log.warning('Rejected invalid blocks from %s', node)
+                    break
+                branch.extend(blocks)
+
+                with self.chain_lock:
+                    # Our chain may have moved on while we were downloading
+                    if self.hash(self.chain[fork - 1]) != fork_hash:
+                        break
+                    if len(self.chain) >= fork + len(branch):
+                        continue
+                    if not self.valid_spends(fork, branch):
+                        consensus_log.warning('Rejected blocks from %s that overspend', node)
+                        break
+
+                    consensus_log.info('Replacing %d blocks after block %d with %d from %s',
+                                       len(self.chain) - fork, fork, len(branch), node)
+                    self.replace_blocks(fork, branch, verified=True)
+                    branch = None
+                    changed = True
+        finally:
+            for future in downloads:
+                future.cancel()
+
+        if changed:
+            with self.chain_lock:
+                self.connect_orphans(self.hash(self.last_block))
+        return changed
+
+    def fetch_ancestors(self, node, block):
+        """
+        Ask the peer that sent us an orphan for the blocks it builds on
+
+        The orphan's parent is fetched from the peer and added, then the
+        parent's parent if that is an orphan too, and so on.  If we are
+        still missing blocks after ORPHAN_LOOKAHEAD of them, or the peer
+        can't send them, we have fallen behind rather than missed a block,
+        so we sync instead.
+        :param node: <str> The peer that sent the orphan
+        :param block: <dict> The orphan
+        :return: <bool> True if the orphan was connected, False if not
+        """
+
+        orphan_hash, orphan_index = self.hash(block), block['index']
+
+        for _ in range(ORPHAN_LOOKAHEAD):
+            parent = self.fetch_block(node, block['index'] - 1, block['previous_hash'])
+            if parent is None:
+                break
+            if self.add_block(parent) != 'orphan':
+                return self.find_block(orphan_hash, orphan_index) is not None
+            block = parent
+
+        consensus_log.info('Could not fill in the blocks before block %d from %s, syncing',
+                           orphan_index, node)
+        self.resolve_conflicts()
+        return self.find_block(orphan_hash, orphan_index) is not None
+
+    def fetch_block(self, node, index, block_hash):
+        """
+        :param node: <str> The peer's address
+        :param index: <int> Index of the block wanted
+        :param block_hash: <str> Hash of the block wanted
+        :return: <Block> The block, or None if the peer couldn't send it or
+        has another block at `index`
+        """
+
+        if index < 1:
+            return None
+        try:
+            response = self.peers.get(node, f'/blocks/{index}', timeout=CONSENSUS_TIMEOUT)
+            response.raise_for_status()
+            block = Block(response.json()['block'])
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            consensus_log.warning('Could not get block %d from %s: %s', index, node, e)
+            return None
+
+        if self.hash(block) != block_hash:
+            return None
+        return block
+
+    def fetch_headers(self, node, first, last):
+        """
+        :param node: <str> The peer's address
+        :param first: <int> Index of the first header wanted
+        :param last: <int> Index of the last header wanted
+        :return: <list> The peer's headers from `first` to `last`, or None
+        """
+
+        headers = []
+        cursor = first
+        try:
+            while cursor is not None and cursor <= last:
+                response = self.peers.get(node, '/headers',
+                                          params={'cursor': cursor, 'to': last},
+                                          timeout=CONSENSUS_TIMEOUT)
+                response.raise_for_status()
+                page = response.json()
+                headers.extend(page['chain'])
+                cursor = page['next']
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            consensus_log.warning('Could not get headers from %s: %s', node, e)
+            return None
+
+        return headers
+
+    def fetch_blocks(self, node, headers):
+        """
+        Download the blocks behind a run of headers
+
+        :param node: <str> The peer's address
+        :param headers: <list> Consecutive headers, at most SYNC_BATCH_SIZE
+        :return: <list> The blocks as Blocks, or None if the peer couldn't
+        send them in time or sent blocks that don't match the headers
+        """
+
+        first, last = headers[0]['index'], headers[-1]['index']
+        try:
+            response = self.peers.get(node, '/chain',
+                                      params={'from': first, 'to': last},
+                                      timeout=CONSENSUS_TIMEOUT)
+            response.raise_for_status()
+            blocks = [Block(block) for block in response.json()['chain']]
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            consensus_log.warning('Could not get blocks %d to %d from %s: %s',
+                                  first, last, node, e)
+            return None
+
+        if len(blocks) != len(headers) or any(
+                self.hash(block) != header['hash'] for block, header in zip(blocks, headers)):
+            consensus_log.warning('Blocks %d to %d from %s do not match their headers',
+                                  first, last, node)
+            return None
+
+        return blocks
+
+    @staticmethod
+    def header(block):
+        """
+        Strip a Block down to its header
+
+        :param block: <dict> Block
+        :return: <dict> The block without its transactions, but with a count
+        of them, their `transaction_root` and the block's own hash
+        """
+
+        header = {k: v for k, v in block.items() if k != 'transactions'}
+        header['transaction_count'] = len(block['transactions'])
+        header['transaction_root'] = Blockchain.transaction_root(block['transactions'])
+        header['hash'] = Blockchain.hash(block)
+        return header
+
+    @staticmethod
+    def transaction_root(transactions):
+        """
+        Merkle root of a block's transactions
+
+        Each transaction is hashed as sorted JSON, then neighbouring hashes
+        are hashed together in pairs, the last one pairing with itself on
+        levels of odd length, until one hash is left.
+        :param transactions: <list> The block's transactions
+        :return: <str> Hex SHA-256 root, or None if there are none
         """
 
-        neighbors = self.nodes
+        level = [hashlib.sha256(json.dumps(tx, sort_keys=True).encode()).digest()
+                 for tx in transactions]
+        if not level:
+            return None
+
+        while len(level) > 1:
+            if len(level) % 2:
+                level.append(level[-1])
+            level = [hashlib.sha256(level[i] + level[i + 1]).digest()
+                     for i in range(0, len(level), 2)]
+        return level[0].hex()
+
+    @staticmethod
+    def encode(block):
+        """
+        The sorted JSON of a Block, which is what gets hashed and proven
 
-        post_data = {"block": block}
+        :param block: <dict> Block
+        :return: <bytes>
+        """
 
-        for node in neighbors:
-            response = requests.post(f'http://{node}/block/new', json=post_data)
+        # Sealed blocks remember their encoding
+        if isinstance(block, Block):
+            return block.encoded
+        return json.dumps(block, sort_keys=True).encode()
 
     @staticmethod
     def hash(block):
@@ -118,7 +1088,11 @@ class Blockchain(object):
         # We must make sure that the Dictionary is Ordered,
         # or we'll have inconsistent hashes
 
-        block_string = json.dumps(block, sort_keys=True).encode()
+        # Sealed blocks remember their hash
+        if isinstance(block, Block):
+            return block.hash
+
+        block_string = Blockchain.encode(block)
 
         # By itself, this function returns the hash in a raw string
         # that will likely include escaped characters.
@@ -129,56 +1103,504 @@ class Blockchain(object):
 
     @property
     def last_block(self):
-        return self.chain[-1]
+        return self.tip
+
+    def snapshot(self):
+        """
+        :return: <ChainSnapshot> The chain as it is now, to read without a lock
+        """
+
+        return ChainSnapshot(self)
+
+    def replace_blocks(self, start, blocks, verified=False):
+        """
+        Replace every block from position `start` onwards with `blocks`
+
+        :param start: <int> Number of our blocks to keep
+        :param blocks: <list> The blocks to follow them
+        :param verified: (Optional) <bool> True if `blocks` are already known
+        to follow on validly from our block at `start`
+        """
+
+        with self.chain_lock:
+            # The blocks being kept are still valid, so only pull the
+            # checkpoint back to the last of them
+            if self.verified_height > start:
+                self.verified_height = start
+                self.verified_hash = self.hash(self.chain[start - 1]) if start else None
+
+            # Transactions in the blocks rolled back need confirming again,
+            # unless `blocks` confirm them too
+            rolled_back_blocks = self.chain[start:]
+            rolled_back = self.unconfirmed(rolled_back_blocks, blocks)
+
+            # Tell snapshots before any block goes
+            if start < len(self.chain):
+                self.reorgs += 1
+
+            with self.spend_lock:
+                del self.chain[start:]
+                for block in reversed(rolled_back_blocks):
+                    self.apply_balances(block, -1)
+                    self.unindex_transactions(block)
+                for block in blocks:
+                    block = block if isinstance(block, Block) else Block(block)
+                    self.chain.append(block)
+                    self.apply_balances(block)
+                    self.index_transactions(block)
+                self.tip = self.chain[-1]
+                self.strip_confirmed(blocks)
+
+            # Back into the mempool, if their senders can still afford them
+            self.new_transactions(rolled_back)
+
+            if verified and self.verified_height == start:
+                self.verified_height = len(self.chain)
+                self.verified_hash = self.hash(self.last_block)
+            else:
+                self.advance_checkpoint()
+        self.notify_new_tip()
+
+    def unconfirmed(self, rolled_back_blocks, blocks):
+        """
+        :param rolled_back_blocks: <list> Blocks being rolled back
+        :param blocks: <list> The blocks replacing them
+        :return: <list> Transactions, other than mining rewards, in
+        `rolled_back_blocks` and not in `blocks`, counting identical
+        transactions one by one
+        """
+
+        if not rolled_back_blocks:
+            return []
+
+        confirmed = Counter(transaction_id(tx) for block in blocks
+                            for tx in block['transactions'])
+        unconfirmed = []
+        for block in rolled_back_blocks:
+            for tx in block['transactions']:
+                tx_id = transaction_id(tx)
+                if confirmed[tx_id]:
+                    confirmed[tx_id] -= 1
+                elif tx['sender'] != '0':
+                    unconfirmed.append(tx)
+        return unconfirmed
+
+    def add_block(self, block):
+        """
+        Ingest a block from a peer
+
+        The block's structure is checked before anything else, then it is
+        connected to the block tree with its link and proof checked once,
+        all while holding `chain_lock` so the chain never changes half way.
+        :param block: <dict> Block
+        :return: <str> 'invalid' if the block is malformed, otherwise what
+        `insert_block` made of it
+        """
+
+        if not self.valid_structure(block):
+            validation_log.warning('Malformed block %s', block)
+            return 'invalid'
+
+        with self.chain_lock:
+            return self.connect_block(block)
+
+    def add_blocks(self, blocks):
+        """
+        Ingest a run of blocks, such as a batch synced from a peer, taking
+        `chain_lock` only once
+
+        :param blocks: <list> Blocks, parents before children
+        :return: <list> What `add_block` made of each block
+        """
+
+        started = perf_counter()
+        statuses = ['invalid'] * len(blocks)
+        wellformed = [i for i, block in enumerate(blocks) if self.valid_structure(block)]
+
+        with self.chain_lock:
+            for i in wellformed:
+                statuses[i] = self.connect_block(blocks[i])
+
+        elapsed = perf_counter() - started
+        validation_log.info('Ingested %d blocks in %.3f seconds (%.0f blocks/s)',
+                            len(blocks), elapsed, len(blocks) / elapsed if elapsed else 0)
+        return statuses
 
     @staticmethod
-    def valid_proof(block_string, proof):
+    def valid_structure(block):
         """
-        Validates the Proof:  Does hash(block_string, proof) contain 6
-        leading zeroes?  Return true if the proof is valid
+        Check that a block has exactly the fields a block has, of the right
+        types, and that its transactions do too, with at most one of them
+        paying its miner the MINING_REWARD
+
+        :param block: <dict> Block
+        :return: <bool> True if well formed, False if not
+        """
+
+        if not isinstance(block, dict) or block.keys() != BLOCK_FIELDS.keys():
+            return False
+        if not all(isinstance(block[k], t) and not isinstance(block[k], bool)
+                   for k, t in BLOCK_FIELDS.items()):
+            return False
+        if not all(isinstance(tx, dict) and
+                   TRANSACTION_FIELDS <= tx.keys() <= TRANSACTION_FIELDS | TRANSACTION_OPTIONAL and
+                   valid_amount(tx['amount'])
+                   for tx in block['transactions']):
+            return False
+
+        rewards = [tx for tx in block['transactions'] if tx['sender'] == '0']
+        return len(rewards) <= 1 and all(tx['amount'] == MINING_REWARD for tx in rewards)
+
+    def strip_confirmed(self, blocks):
+        """
+        Drop the transactions `blocks` confirm from the mempool
+
+        :param blocks: <list> Blocks just added to our chain
+        """
+
+        self.mempool.remove([tx for block in blocks for tx in block['transactions']])
+
+    def connect_block(self, block):
+        """
+        Add a block to the block tree, along with any orphans waiting on it
+
+        A block whose parent we haven't seen yet is held in the orphan pool.
+        As soon as a block is connected, the orphans building on it are
+        connected too, and then theirs, and so on.
+        :param block: <dict> Block
+        :return: <str> What `insert_block` made of `block`
+        """
+
+        if not isinstance(block, Block):
+            block = Block(block)
+
+        status = self.insert_block(block)
+        if status == 'orphan':
+            self.add_orphan(block)
+        elif status in ('extended', 'reorganized', 'side'):
+            self.connect_orphans(self.hash(block))
+        return status
+
+    def insert_block(self, block):
+        """
+        Add a single block to the block tree
+
+        A block building on our last block extends the chain.  One building
+        on any other block we know of starts or extends a side branch, kept
+        in `side_blocks`.  If a side branch ends up with more cumulative
+        work than our chain, we reorganize onto it, rolling back and
+        applying only the blocks after the fork.
+        :param block: <Block> Block
+        :return: <str> 'extended' or 'reorganized' if the block is now our last
+        block, 'side' if it is on a side branch, 'known' if we already have
+        it, 'orphan' if we don't know its parent, 'stale' if it forks off
+        more than MAX_FORK_DEPTH blocks below our last block, or 'invalid',
+        which includes spending more than a sender has
+        """
+
+        block_hash = self.hash(block)
+
+        if block_hash in self.side_blocks or self.find_block(block_hash, block['index']) is not None:
+            return 'known'
+        if block['index'] <= len(self.chain) - MAX_FORK_DEPTH:
+            return 'stale'
+
+        parent = self.find_block(block['previous_hash'], block['index'] - 1)
+        if parent is None:
+            return 'orphan'
+        if block['index'] != parent['index'] + 1 or not self.valid_link(parent, block, block['index']):
+            return 'invalid'
+
+        # Building on our last block
+        if block['previous_hash'] == self.hash(self.last_block):
+            if not self.valid_spends(len(self.chain), [block]):
+                return 'invalid'
+            with self.spend_lock:
+                self.chain.append(block)
+                self.tip = block
+                self.apply_balances(block)
+                self.index_transactions(block)
+                self.strip_confirmed([block])
+            # The link was just checked, so don't check it again
+            if self.verified_height == len(self.chain) - 1:
+                self.verified_height += 1
+                self.verified_hash = block_hash
+            else:
+                self.advance_checkpoint()
+            self.prune_forks()
+            self.notify_new_tip()
+            return 'extended'
+
+        work = self.work(parent) + BLOCK_WORK
+        self.side_blocks[block_hash] = (block, work)
+        if work <= self.work(self.last_block):
+            return 'side'
+
+        if not self.reorganize(block):
+            return 'invalid'
+        return 'reorganized'
+
+    def add_orphan(self, block):
+        """
+        Hold a block until its parent arrives, dropping the oldest orphan
+        once there are more than MAX_ORPHANS
+
+        :param block: <Block> A block whose parent we don't have
+        """
+
+        block_hash = self.hash(block)
+        if block_hash in self.orphans:
+            return
+
+        self.orphans[block_hash] = block
+        self.orphans_by_parent.setdefault(block['previous_hash'], set()).add(block_hash)
+
+        while len(self.orphans) > MAX_ORPHANS:
+            self.remove_orphan(next(iter(self.orphans)))
+
+    def remove_orphan(self, block_hash):
+        block = self.orphans.pop(block_hash)
+        siblings = self.orphans_by_parent[block['previous_hash']]
+        siblings.discard(block_hash)
+        if not siblings:
+            del self.orphans_by_parent[block['previous_hash']]
+
+    def connect_orphans(self, parent_hash):
+        """
+        Connect the orphans descending from a block that was just connected
+
+        :param parent_hash: <str> Hash of the block
+        """
+
+        parents = [parent_hash]
+        while parents:
+            for block_hash in self.orphans_by_parent.pop(parents.pop(), ()):
+                block = self.orphans.pop(block_hash)
+                if self.insert_block(block) in ('extended', 'reorganized', 'side'):
+                    parents.append(block_hash)
+
+    def find_block(self, block_hash, index):
+        """
+        :param block_hash: <str> Hash of the block
+        :param index: <int> Its index
+        :return: <dict> The block, from our chain or a side branch, or None
+        if we don't have it
+        """
+
+        if block_hash in self.side_blocks:
+            return self.side_blocks[block_hash][0]
+        if 1 <= index <= len(self.chain):
+            block = self.chain[index - 1]
+            if self.hash(block) == block_hash:
+                return block
+        return None
+
+    def on_chain(self, block):
+        """
+        :param block: <dict> Block
+        :return: <bool> True if `block` is on our chain, not a side branch
+        """
+
+        index = block['index']
+        return 1 <= index <= len(self.chain) and self.hash(self.chain[index - 1]) == self.hash(block)
+
+    def work(self, block):
+        """
+        :param block: <dict> A block on our chain or a side branch
+        :return: <int> Cumulative work of the chain ending at `block`
+        """
+
+        block_hash = self.hash(block)
+        if block_hash in self.side_blocks:
+            return self.side_blocks[block_hash][1]
+        return block['index'] * BLOCK_WORK
+
+    def reorganize(self, tip):
+        """
+        Make the side branch ending at `tip` our chain
+
+        The branch is walked back to where it forks off our chain, and only
+        the blocks after that are swapped, so this costs time in proportion
+        to the depth of the reorganization rather than the length of the
+        chain.  The blocks rolled back are kept as a side branch in turn.
+        :param tip: <dict> The last block of a side branch
+        :return: <bool> True if the branch is now our chain, False if it
+        spends more than its senders have, in which case `tip` is dropped
+        """
+
+        branch = [tip]
+        while not self.on_chain(branch[-1]):
+            branch.append(self.find_block(branch[-1]['previous_hash'],
+                                          branch[-1]['index'] - 1))
+        branch.pop()
+        branch.reverse()
+
+        fork = branch[0]['index'] - 1
+        if not self.valid_spends(fork, branch):
+            del self.side_blocks[self.hash(tip)]
+            return False
+
+        for block in self.chain[fork:]:
+            self.side_blocks[self.hash(block)] = (block, block['index'] * BLOCK_WORK)
+        for block in branch:
+            del self.side_blocks[self.hash(block)]
+
+        consensus_log.info('Reorganizing: replacing %d blocks after block %d with %d',
+                           len(self.chain) - fork, fork, len(branch))
+        self.replace_blocks(fork, branch, verified=True)
+        self.prune_forks()
+        return True
+
+    def prune_forks(self):
+        """
+        Forget side branches forking off more than MAX_FORK_DEPTH blocks
+        below our last block, and orphans that far down
+
+        A branch is dropped whole, by where it forks off our chain, so a
+        side block is never kept once its parent is gone.
+        """
+
+        lowest = len(self.chain) - MAX_FORK_DEPTH
+
+        # Index of the block on our chain each side block's branch forks off
+        forks = {}
+        for block_hash in self.side_blocks:
+            branch = []
+            while block_hash in self.side_blocks and block_hash not in forks:
+                branch.append(block_hash)
+                block_hash = self.side_blocks[block_hash][0]['previous_hash']
+            fork = forks.get(block_hash)
+            if fork is None:
+                fork = self.side_blocks[branch[-1]][0]['index'] - 1
+            for branch_hash in branch:
+                forks[branch_hash] = fork
+
+        # The same test `insert_block` turns stale blocks away with, applied
+        # to the first block of each branch
+        for block_hash in [h for h, fork in forks.items() if fork + 1 <= lowest]:
+            del self.side_blocks[block_hash]
+        for block_hash in [h for h, block in self.orphans.items()
+                           if block['index'] <= lowest]:
+            self.remove_orphan(block_hash)
+
+    def notify_new_tip(self):
+        """
+        Wake up everyone waiting in `wait_for_new_tip`
+        """
+
+        with self.tip_changed:
+            self.tip_changed.notify_all()
+        self.save_periodically()
+
+    def save_periodically(self):
+        """
+        Save the indexes in the background once the chain has moved
+        INDEX_SAVE_INTERVAL blocks from where they were last saved
+
+        Saving at shutdown alone loses them all on a crash or a kill, and
+        then every block is decoded again on the next start.
+        """
+
+        if self.index_path() is None:
+            return
+
+        with self.chain_lock:
+            if abs(len(self.chain) - self.saved_height) < INDEX_SAVE_INTERVAL:
+                return
+            # Counted as saved now, so the blocks added before the save gets
+            # to run don't queue up more of them
+            self.saved_height = len(self.chain)
+        self.save_pool.submit(self.save_indexes)
+
+    def wait_for_new_tip(self, known_hash, timeout):
+        """
+        Wait until the last block is no longer the one hashing to `known_hash`
+
+        :param known_hash: <str> Hash of the last block the caller knows about
+        :param timeout: <float> Longest time to wait, in seconds
+        :return: <dict> The last block, which is unchanged if we timed out
+        """
+
+        with self.tip_changed:
+            self.tip_changed.wait_for(
+                lambda: self.hash(self.last_block) != known_hash, timeout)
+            return self.last_block
+
+    @staticmethod
+    def proof_prefix(block_string):
+        """
+        Hash the part of every guess that does not change
+
+        Each guess is `f'{block_string}{proof}'`, so the block string can be
+        hashed once and the hash state copied for every proof that is tried.
+        :param block_string: <bytes> The stringified block
+        :return: <hashlib hash> SHA-256 state after hashing the block string
+        """
+
+        return hashlib.sha256(f'{block_string}'.encode())
+
+    @staticmethod
+    def valid_guess(prefix, proof, target=TARGET):
+        """
+        Validates the Proof against a precomputed `proof_prefix`.  Gives the
+        same answer as `valid_proof(block_string, proof)` without re-hashing
+        the block string.
+        :param prefix: <hashlib hash> The result of `proof_prefix`
+        :param proof: <int?> The proof to check
+        :param target: <tuple> The result of `proof_target`
+        :return: True if the resulting hash is a valid proof, False otherwise
+        """
+
+        guess_hash = prefix.copy()
+        guess_hash.update(f'{proof}'.encode())
+
+        size, limit = target
+        return int.from_bytes(guess_hash.digest()[:size], 'big') < limit
+
+    @staticmethod
+    def valid_proof(block_string, proof, target=TARGET):
+        """
+        Validates the Proof:  Does hash(block_string, proof) have `DIFFICULTY`
+        leading zero bits?  Return true if the proof is valid
         :param block_string: <string> The stringified block to use to
         check in combination with `proof`
         :param proof: <int?> The value that when combined with the
         stringified previous block results in a hash that has the
-        correct number of leading zeroes.
+        correct number of leading zero bits.
         :return: True if the resulting hash is a valid proof, False otherwise
         """
 
-        guess = f'{block_string}{proof}'.encode()
-        guess_hash = hashlib.sha256(guess).hexdigest()
+        return Blockchain.valid_guess(Blockchain.proof_prefix(block_string), proof, target)
 
-        # if guess_hash[:3] == "000":
-        #     print(f"guess: {guess}, guess_hash {guess_hash} | {guess_hash[:3]} == '000' #=> {guess_hash[:3] == '000'}")
-
-        # return guess_hash[:6] == "000000"
-        return guess_hash[:3] == "000"
-
-    def valid_chain(self, chain):
+    def valid_chain(self, chain, start=0, workers=None):
         """
         Determine if a given blockchain is valid.  We'll need this
         later when we are a part of a network.
 
         :param chain: <list> A blockchain
+        :param start: (Optional) <int> Position of a block already known to
+        be valid.  Only the blocks after it are checked.
+        :param workers: (Optional) <int> Number of processes to check long
+        chains with, defaulting to one per CPU
         :return: <bool> True if valid, False if not
         """
 
-        prev_block = chain[0]
-        current_index = 1
+        workers = workers or os.cpu_count() or 1
+        if workers > 1 and len(chain) - start >= PARALLEL_VERIFY_MIN:
+            return self.first_invalid_block(chain, start, workers) is None
+
+        prev_block = chain[start]
+        current_index = start + 1
+
+        # Look the level up once rather than once per block
+        trace = validation_log.isEnabledFor(logging.DEBUG)
 
         while current_index < len(chain):
             block = chain[current_index]
-            print(f'{prev_block}')
-            print(f'{block}')
-            print("\n-------------------\n")
-            # Check that the hash of the block is correct
-            if block['previous_hash'] != self.hash(prev_block):
-                print(f"Invalid previous hash on block {current_index}")
-                return False
-
-            # Check that the Proof of Work is correct
-            block_string = json.dumps(prev_block, sort_keys=True).encode()
-            if not self.valid_proof(block_string, block['proof']):
-                print(f"Found invalid proof on block {current_index}")
+            if trace:
+                validation_log.debug('Checking block %d\n%s\n%s',
+                                     current_index, prev_block, block)
+            if not self.valid_link(prev_block, block, current_index):
                 return False
 
             prev_block = block
@@ -186,6 +1608,179 @@ class Blockchain(object):
 
         return True
 
+    def valid_link(self, prev_block, block, current_index):
+        """
+        Check that `block` correctly follows `prev_block`
+
+        :param prev_block: <dict> Block
+        :param block: <dict> The Block after it
+        :param current_index: <int> Position of `block`, for messages
+        :return: <bool> True if valid, False if not
+        """
+
+        # Check that the hash of the block is correct
+        if block['previous_hash'] != self.hash(prev_block):
+            validation_log.warning('Invalid previous hash on block %d', current_index)
+            return False
+
+        # Check that the Proof of Work is correct
+        block_string = self.encode(prev_block)
+        if not self.valid_proof(block_string, block['proof']):
+            validation_log.warning('Found invalid proof on block %d', current_index)
+            return False
+
+        return True
+
+    def first_invalid_block(self, chain, start=0, workers=None):
+        """
+        Find the first block of `chain` that doesn't follow the one before it
+
+        Each link only depends on the pair of blocks it joins, so the chain
+        is cut into overlapping shards that are checked in parallel.
+        :param chain: <list> A blockchain
+        :param start: (Optional) <int> Position of a block already known to
+        be valid.  Only the blocks after it are checked.
+        :param workers: (Optional) <int> Number of processes to use,
+        defaulting to one per CPU
+        :return: <int> Position of the first invalid block, or None if the
+        chain is valid
+        """
+
+        workers = workers or os.cpu_count() or 1
+        shard_size = max(1, -(-(len(chain) - start - 1) // (workers * SHARDS_PER_WORKER)))
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Each shard repeats the last block of the shard before it
+            futures = [
+                executor.submit(first_invalid_in_shard,
+                                chain[first:first + shard_size + 1], first)
+                for first in range(start, len(chain) - 1, shard_size)
+            ]
+
+            # Shards are in chain order, so the first one with an invalid
+            # block has the answer and the rest can be dropped
+            for future in futures:
+                invalid = future.result()
+                if invalid is not None:
+                    for later in futures:
+                        later.cancel()
+                    return invalid
+
+        return None
+
+    def validate(self, full=False):
+        """
+        Determine if our own chain is valid
+
+        Blocks up to the verified checkpoint aren't checked again unless
+        `full` is given.  A long run of blocks to check, such as a whole
+        chain at startup, is checked across the process pool from a
+        snapshot, without holding `chain_lock`, so mining and ingest carry
+        on meanwhile.  The checkpoint then moves to the last valid block if
+        that is still on our chain.
+        :param full: (Optional) <bool> Revalidate the whole chain
+        :return: <bool> True if valid, False if not
+        """
+
+        while True:
+            with self.chain_lock:
+                height = 1 if full else self.checkpoint_height()
+                chain = self.snapshot()
+            if len(chain) - height < PARALLEL_VERIFY_MIN:
+                break
+
+            try:
+                invalid = self.first_invalid_block(chain, height - 1)
+                height = invalid or len(chain)
+                verified_hash = self.hash(chain[height - 1])
+            except ChainChanged:
+                # Rolled back while we checked, so check what replaced it
+                continue
+
+            with self.chain_lock:
+                if invalid is not None or height > self.checkpoint_height():
+                    if height <= len(self.chain) and self.hash(self.chain[height - 1]) == verified_hash:
+                        self.verified_height = height
+                        self.verified_hash = verified_hash
+                if invalid is not None:
+                    return False
+                return self.advance_checkpoint()
+
+        with self.chain_lock:
+            if full:
+                self.verified_height = 0
+            return self.advance_checkpoint()
+
+    def checkpoint_height(self):
+        """
+        :return: <int> How many blocks at the start of the chain are known
+        to be valid: the verified checkpoint, or just the genesis block if
+        the chain has been replaced beneath it
+        """
+
+        height = self.verified_height
+        if height and (height > len(self.chain) or
+                       self.hash(self.chain[height - 1]) != self.verified_hash):
+            height = 0
+
+        # The genesis block is taken on trust
+        return max(height, 1)
+
+    def advance_checkpoint(self):
+        """
+        Check the blocks added since the verified checkpoint
+
+        The checkpoint is the number of blocks at the start of the chain
+        known to be valid, along with the hash of the last of them.  It
+        moves up to the last valid block, so each block is only checked
+        once as the chain grows.  If the chain has been replaced beneath
+        the checkpoint, checking starts again from the genesis block.
+        :return: <bool> True if the whole chain is valid, False if not
+        """
+
+        height = self.checkpoint_height()
+
+        valid = True
+        while height < len(self.chain):
+            if not self.valid_link(self.chain[height - 1], self.chain[height], height):
+                valid = False
+                break
+            height += 1
+
+        self.verified_height = height
+        self.verified_hash = self.hash(self.chain[height - 1])
+        return valid
+
+
+def valid_amount(amount):
+    """
+    :param amount: The amount of a transaction
+    :return: <bool> True if it is a positive number of coins
+    """
+
+    return isinstance(amount, (int, float)) and not isinstance(amount, bool) and amount > 0
+
+
+def first_invalid_in_shard(blocks, offset):
+    """
+    Worker for `Blockchain.first_invalid_block`
+
+    :param blocks: <list> Consecutive blocks from a chain
+    :param offset: <int> Position of the first of them in the chain
+    :return: <int> Position of the first block that doesn't follow the one
+    before it, or None if they all do
+    """
+
+    prev_block = blocks[0]
+    for position, block in enumerate(blocks[1:], offset + 1):
+        if block['previous_hash'] != Blockchain.hash(prev_block):
+            return position
+        if not Blockchain.valid_proof(Blockchain.encode(prev_block), block['proof']):
+            return position
+        prev_block = block
+
+    return None
+
 #
 # Define a web API using Flask.
 #
@@ -199,40 +1794,128 @@ node_identifier = str(uuid4()).replace('-', '')
 # Instantiate the Blockchain
 blockchain = Blockchain()
 
+# Query arguments that ask for one page of the chain, and the most blocks a
+# page may hold
+PAGE_ARGS = ('from', 'to', 'cursor', 'limit')
+PAGE_SIZE = 100
+
+# Most transactions `/transactions/batch` takes in one request
+BATCH_LIMIT = 10000
+
+# Formats `/chain?stream=` can send the chain in, with their mimetypes
+STREAM_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def valid_transaction(values):
+    """
+    :param values: <dict> A transaction's fields, as sent to us
+    :return: <bool> True if its addresses are strings, its amount a
+    positive number of coins, and its nonce, if any, a string or integer
+    """
+
+    nonce = values.get('nonce')
+    return (isinstance(values['sender'], str) and isinstance(values['recipient'], str)
+            and valid_amount(values['amount'])
+            and (nonce is None or isinstance(nonce, (str, int)) and not isinstance(nonce, bool)))
+
+
+def page_bounds(args, length):
+    """
+    Work out which blocks a paginated request is asking for
+
+    `from` and `to` are inclusive block indexes, defaulting to the whole
+    chain.  At most `limit` blocks are returned per page, and the returned
+    cursor is passed back as `cursor` to get the next page.
+    :param args: <dict> The request's query arguments
+    :param length: <int> Length of the chain
+    :return: <tuple> (first index, last index, cursor or None when done)
+    """
+
+    start = int(args.get('cursor', args.get('from', 1)))
+    end = min(int(args.get('to', length)), length)
+    limit = min(int(args.get('limit', PAGE_SIZE)), PAGE_SIZE)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+
+    start = max(start, 1)
+    stop = min(end, start + limit - 1)
+    cursor = stop + 1 if stop < end else None
+
+    return start, stop, cursor
+
+
+def stream_chain(chain, stream_format):
+    """
+    Serialize `chain` one block at a time
+
+    Stored blocks are sent as the bytes already on disk, so neither the
+    chain nor the response body is ever held in memory as a whole.  If the
+    chain is reorganized part way through, the response is cut short.
+    :param chain: <ChainSnapshot> The chain to send
+    :param stream_format: <str> 'json' for the same object `/chain` sends, or
+    'ndjson' for one block per line
+    :return: <generator> The response body in chunks of bytes
+    """
+
+    length = len(chain)
+
+    if stream_format == 'json':
+        yield b'{"chain": ['
+
+    for position in range(length):
+        block = chain.read_bytes(position)
+
+        if stream_format == 'ndjson':
+            yield block + b'\n'
+        elif position:
+            yield b', ' + block
+        else:
+            yield block
+
+    if stream_format == 'json':
+        yield b'], "length": %d}' % length
+
 
 @app.route('/mine', methods=['POST'])
 def mine():
     values = request.json
 
     # Check that the required fields are in the POST'ed data
-    required = ['proof']
+    required = ['proof', 'id']
     if not all(k in values for k in required):
         return 'Missing Values', 400
 
-    if 'proof' in values:
-        proof = values['proof']
-
-        # Validate or reject proof of work.
-        block_string = json.dumps(blockchain.last_block, sort_keys=True).encode()
-        is_valid = blockchain.valid_proof(block_string, proof)
-    else:
-        proof = None
-
-    if proof and is_valid:
-        # We must receive a reward for finding the proof.
-        # The sender is "0" to signify that this node has mined a new coin
-        # The recipient is the current node, it did the mining!
-        # The amount is 1 coin as a reward for mining the next block
-        blockchain.new_transaction(
-            sender="0",
-            recipient=values['id'],
-            amount=1,
-        )
-
-        # Forge the new Block by adding it to the chain
-        previous_hash = blockchain.hash(blockchain.last_block)
-        block = blockchain.new_block(proof, previous_hash)
-
+    # Check the proof and forge the block under the chain lock, so two
+    # winning miners can't both build on the same last block
+    with blockchain.chain_lock:
+        if 'proof' in values:
+            proof = values['proof']
+
+            # Validate or reject proof of work.
+            block_string = blockchain.encode(blockchain.last_block)
+            is_valid = blockchain.valid_proof(block_string, proof)
+        else:
+            proof = None
+
+        if proof is not None and is_valid:
+            # We must receive a reward for finding the proof.
+            # The sender is "0" to signify that this node has mined a new coin
+            # The recipient is the miner, it did the mining!
+            blockchain.new_reward(values['id'])
+
+            # Forge the new Block by adding it to the chain
+            previous_hash = blockchain.hash(blockchain.last_block)
+            block = blockchain.new_block(proof, previous_hash)
+        else:
+            block = None
+
+    if block is not None:
+        mining_log.info('Forged block %d with proof %s', block['index'], proof)
+
+        # Peers are told in the background, so we answer without waiting
         blockchain.broadcast_new_block(block)
 
         # Send a response with reward
@@ -245,6 +1928,9 @@ def mine():
         }
         return jsonify(response), 200
     else:
+        mining_log.info('Rejected proof %s for block %d', proof,
+                        blockchain.last_block['index'] + 1)
+
         # Send a response with rejection
         response = {
             'message': "New proof rejected"
@@ -256,38 +1942,253 @@ def mine():
 def new_transaction():
     values = request.get_json()
 
-    if values is None:
+    if not isinstance(values, dict):
         return 'Missing Values', 400
 
     # Check that the required fields are in the POST'ed data
     required = ['sender', 'recipient', 'amount']
     if not all(k in values for k in required):
         return 'Missing Values', 400
+    if not valid_transaction(values):
+        return 'Invalid Values', 400
 
     # Create a new Transaction
-    index = blockchain.new_transaction(values['sender'],
-                                       values['recipient'],
-                                       values['amount'])
+    try:
+        index = blockchain.new_transaction(values['sender'],
+                                           values['recipient'],
+                                           values['amount'],
+                                           values.get('nonce'))
+    except TransactionRejected as e:
+        return str(e), 400
 
     response = {'message': f'Transaction will be added to Block {index}'}
     return jsonify(response), 201
 
 
+@app.route('/transactions/batch', methods=['POST'])
+def new_transactions():
+    # Take a JSON array, or one transaction per line as NDJSON
+    if request.mimetype == 'application/x-ndjson':
+        items = []
+        for line in request.get_data().splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            return 'Expected a JSON array or NDJSON', 400
+
+    if len(items) > BATCH_LIMIT:
+        return f'At most {BATCH_LIMIT} transactions per batch', 413
+
+    # Check every transaction in one pass, before any of them is created,
+    # so one bad item can't fail the batch part way through
+    required = ['sender', 'recipient', 'amount']
+    results = [None] * len(items)
+    wellformed = []
+    for position, values in enumerate(items):
+        if values is None:
+            results[position] = {'error': 'Invalid JSON'}
+        elif not isinstance(values, dict) or not all(k in values for k in required):
+            results[position] = {'error': 'Missing Values'}
+        elif not valid_transaction(values):
+            results[position] = {'error': 'Invalid Values'}
+        else:
+            wellformed.append(position)
+
+    # Create the new Transactions
+    ids = blockchain.new_transactions([items[position] for position in wellformed])
+    for position, tx_id in zip(wellformed, ids):
+        if isinstance(tx_id, TransactionRejected):
+            results[position] = {'error': str(tx_id)}
+        else:
+            results[position] = {'id': tx_id}
+
+    accepted = sum('id' in result for result in results)
+    response = {
+        'message': f'{accepted} transactions will be added to Block {blockchain.last_block["index"] + 1}',
+        'accepted': accepted,
+        'results': results,
+    }
+    return jsonify(response), 201
+
+
+@app.route('/balance/<address>', methods=['GET'])
+def balance(address):
+    response = {
+        'address': address,
+        'balance': blockchain.balances.get(address, 0),
+        'spendable': blockchain.spendable(address),
+    }
+    return jsonify(response), 200
+
+
 @app.route('/chain', methods=['GET'])
 def full_chain():
+    # Read from a snapshot, so mining never waits on us
+    chain = blockchain.snapshot()
+
+    # With any of the paging arguments, send a single page
+    if any(k in request.args for k in PAGE_ARGS):
+        return chain_page(chain, lambda block: block)
+
+    # Stream the chain rather than building the whole body up front
+    if 'stream' in request.args:
+        stream_format = request.args['stream'] or 'json'
+        if stream_format not in STREAM_FORMATS:
+            return 'Invalid stream format', 400
+        return Response(stream_chain(chain, stream_format),
+                        mimetype=STREAM_FORMATS[stream_format])
+
+    try:
+        response = {
+            'chain': list(chain),
+            'length': len(chain)
+        }
+    except ChainChanged:
+        return 'Chain Changed, Try Again', 503
+    return jsonify(response), 200
+
+
+@app.route('/headers', methods=['GET'])
+def headers():
+    return chain_page(blockchain.snapshot(), blockchain.header)
+
+
+def chain_page(chain, view):
+    """
+    Respond with one page of `chain`, each block passed through `view`
+    """
+
+    try:
+        start, stop, cursor = page_bounds(request.args, len(chain))
+    except ValueError:
+        return 'Invalid range', 400
+
+    try:
+        response = {
+            'chain': [view(block) for block in chain[start - 1:stop]],
+            'length': len(chain),
+            'next': cursor,
+        }
+    except ChainChanged:
+        return 'Chain Changed, Try Again', 503
+    return jsonify(response), 200
+
+
+@app.route('/blocks/<int:index>', methods=['GET'])
+def block_by_index(index):
+    chain = blockchain.snapshot()
+    if not 1 <= index <= len(chain):
+        return 'Block Not Found', 404
+
+    try:
+        response = {
+            'block': chain[index - 1]
+        }
+    except ChainChanged:
+        return 'Chain Changed, Try Again', 503
+    return jsonify(response), 200
+
+
+@app.route('/address/<address>/transactions', methods=['GET'])
+def address_transactions(address):
+    """
+    Page through the confirmed transactions sent from or to `address`
+
+    Pages work as for `/chain`, except that `from` and `to` count the
+    address's transactions, oldest first, rather than blocks.
+    """
+
+    # Snapshot first, so anything indexed after it is left out rather
+    # than read from a chain it isn't on
+    chain = blockchain.snapshot()
+    locations = blockchain.address_index.get(address, [])
+    # Locations are listed in chain order, so those on the snapshot come
+    # first
+    length = bisect_left(locations, (len(chain) + 1,))
+    try:
+        start, stop, cursor = page_bounds(request.args, length)
+    except ValueError:
+        return 'Invalid range', 400
+
+    transactions = []
+    try:
+        page = locations[start - 1:stop]
+        # Make sure the page wasn't sliced from after a rollback
+        chain.check()
+        for index, position in page:
+            tx = chain[index - 1]['transactions'][position]
+            transactions.append({
+                'block': index,
+                'position': position,
+                'id': transaction_id(tx),
+                'transaction': tx,
+            })
+    except ChainChanged:
+        return 'Chain Changed, Try Again', 503
+
     response = {
-        'chain': blockchain.chain,
-        'length': len(blockchain.chain)
+        'address': address,
+        'transactions': transactions,
+        'length': length,
+        'next': cursor,
+    }
+    return jsonify(response), 200
+
+
+@app.route('/tx/<tx_id>', methods=['GET'])
+def transaction_by_id(tx_id):
+    """
+    Look up a transaction by id, in the chain or else in the mempool
+    """
+
+    chain = blockchain.snapshot()
+    locations = blockchain.tx_index.get(tx_id, [])
+    locations = locations[:bisect_left(locations, (len(chain) + 1,))]
+
+    if not locations:
+        tx = blockchain.mempool.get(tx_id)
+        if tx is None:
+            return 'Transaction Not Found', 404
+        response = {
+            'id': tx_id,
+            'transaction': tx,
+            'locations': [],
+            'pending': True,
+        }
+        return jsonify(response), 200
+
+    try:
+        index, position = locations[0]
+        tx = chain[index - 1]['transactions'][position]
+    except ChainChanged:
+        return 'Chain Changed, Try Again', 503
+
+    response = {
+        'id': tx_id,
+        'transaction': tx,
+        'locations': [{'block': index, 'position': position}
+                      for index, position in locations],
+        'pending': False,
     }
     return jsonify(response), 200
 
 
 @app.route('/valid-chain', methods=['GET'])
 def validate_chain():
-    result = blockchain.valid_chain(blockchain.chain)
+    # Only blocks added since the last validation are checked, unless a
+    # full revalidation is asked for with `?full=1`
+    full = request.args.get('full', '').lower() in ('1', 'true', 'yes')
+    result = blockchain.validate(full)
 
     response = {
-        'validity': result
+        'validity': result,
+        'verified_height': blockchain.verified_height,
     }
     return jsonify(response), 200
 
@@ -297,7 +2198,38 @@ def last_block():
     result = blockchain.last_block
 
     response = {
-        'last-block': result
+        'last-block': result,
+        'difficulty': DIFFICULTY,
+    }
+    return jsonify(response), 200
+
+
+@app.route('/work', methods=['GET'])
+def work():
+    """
+    Long-poll for the block to mine on
+
+    Answers as soon as the last block's hash differs from `since`, or after
+    `timeout` seconds (at most WORK_TIMEOUT) with the unchanged last block.
+    Without `since` it answers straight away.
+    """
+
+    since = request.args.get('since')
+    try:
+        timeout = float(request.args.get('timeout', WORK_TIMEOUT))
+    except ValueError:
+        return 'Invalid timeout', 400
+    # NaN slips through min() and would hold the request open for good
+    if not math.isfinite(timeout):
+        return 'Invalid timeout', 400
+    timeout = min(max(timeout, 0), WORK_TIMEOUT)
+
+    result = blockchain.wait_for_new_tip(since, timeout)
+
+    response = {
+        'last-block': result,
+        'hash': blockchain.hash(result),
+        'difficulty': DIFFICULTY,
     }
     return jsonify(response), 200
 
@@ -319,40 +2251,28 @@ def new_block():
 
     new_block = values['block']
 
-    required_values = ['index', 'previous_hash']
-    if not all(k in new_block for k in required_values):
-        return 'Missing Values', 400
+    # Add it to our block tree, on our chain or a side branch
+    status = blockchain.add_block(new_block)
+    if status in ('extended', 'reorganized', 'side', 'known'):
+        return 'Block Accepted', 200
 
-    old_block = blockchain.last_block
-    # Check that the new block index is 1 higher than our last block
-    if new_block['index'] == old_block['index'] + 1:
-        # Index is correct.
-        if new_block['previous_hash'] == blockchain.hash(old_block):
-            # Hash is correct.
-            block_string = json.dumps(old_block, sort_keys=True).encode()
-            if blockchain.valid_proof(block_string, new_block['proof']):
-                # Proof is correct.
-                blockchain.add_block(new_block)
-                return 'Block Accepted', 200
-        return 'Block Rejected', 400
-    # Otherwise, check for consensus
-    else:
-        # Their index is one greater.  Block could be invalid or we could be behind.
-
-        # Do the consensus process:
-        # Poll all of the nodes in our chain, and get the biggest one:
-        current_chain = blockchain.chain
-        for chain_node in blockchain.nodes:
-            # Get the node's chain
-            res = requests.get(node + '/chain')
-            res = json.loads(res.content)
-            if 'chain' in res and 'length' in res:
-                block_string = json.dumps(old_block, sort_keys=True).encode()
-                isvalid = blockchain.valid_proof(block_string, res['chain'])
-                if isvalid and res['length'] > len(current_chain):
-                    current_chain = res['chain']
-        blockchain.chain = current_chain
-        return 'Consensus Performed', 200
+    # We don't know its parent.  If the block is only just ahead of us we
+    # probably missed its parent, so ask the sender for it in the
+    # background; any further ahead and we have fallen behind.
+    if status == 'orphan' and new_block['index'] <= blockchain.last_block['index'] + ORPHAN_LOOKAHEAD:
+        blockchain.consensus_pool.submit(blockchain.fetch_ancestors, node, new_block)
+        return 'Block Held', 202
+    if status == 'orphan':
+        consensus_log.info('Block %d does not follow our chain, polling %d peers',
+                           new_block['index'], len(blockchain.nodes))
+
+        # Do the consensus process in the background, so the sender isn't
+        # kept waiting:
+        # Switch to the tallest valid chain among our peers
+        blockchain.consensus_pool.submit(blockchain.resolve_conflicts)
+        return 'Consensus Scheduled', 202
+
+    return 'Block Rejected', 400
 
 
 @app.route('/nodes/register', methods=['POST'])
@@ -378,4 +2298,30 @@ if __name__ == '__main__':
         port = int(sys.argv[1])
     else:
         port = 5000
-    app.run(host='0.0.0.0', port=port)
+
+    # Where should the chain be stored?
+    if len(sys.argv) > 2:
+        data_dir = sys.argv[2]
+    else:
+        data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', str(port))
+
+    # Most bytes the mempool may take up, e.g. BLOCKCHAIN_MEMPOOL_BYTES=1048576
+    mempool = Mempool(int(os.environ.get('BLOCKCHAIN_MEMPOOL_BYTES', MAX_BYTES)))
+    blockchain = Blockchain(BlockStore(data_dir), mempool)
+    atexit.register(blockchain.save_indexes)
+    # SIGTERM would otherwise end the process without running atexit
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Where peers can reach us, sent along with the blocks we broadcast
+    blockchain.address = os.environ.get('BLOCKCHAIN_ADDRESS', f'http://localhost:{port}')
+
+    # Log levels, e.g. BLOCKCHAIN_LOG='info,validation=debug'
+    configure_logging(os.environ.get('BLOCKCHAIN_LOG', 'info'))
+
+    # Check the blocks stored since the last verified checkpoint, across
+    # the process pool if there are many of them
+    if not blockchain.validate():
+        validation_log.error('Stored chain is invalid after block %d',
+                             blockchain.verified_height)
+
+    app.run(host='0.0.0.0', port=port, threaded=True)
@@ -0,0 +1,92 @@
+#
+# Dependencies
+#
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+
+#
+# Define a pool of peer connections
+#
+
+# Most connections kept open to any one peer
+POOL_SIZE = 4
+
+
+class PeerSessions(object):
+    """
+    Keeps one keep-alive `requests.Session` per peer
+
+    Requests to the same peer reuse its pooled connections instead of
+    opening a new TCP connection every time.  Each peer's pool holds at most
+    `pool_size` connections; callers beyond that wait for one to free up.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE):
+        self.pool_size = pool_size
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(peer):
+        """
+        :param peer: <str> A peer as a URL, or as `host:port`
+        :return: <str> The peer as `host:port`
+        """
+
+        return urlparse(peer).netloc or peer
+
+    @staticmethod
+    def url(peer, path):
+        """
+        :param peer: <str> A peer as a URL, or as `host:port`
+        :param path: <str> Path on the peer, starting with '/'
+        :return: <str> Full URL of `path` on the peer
+        """
+
+        if '://' in peer:
+            return peer.rstrip('/') + path
+        return f'http://{peer}{path}'
+
+    def session(self, peer):
+        """
+        :param peer: <str> A peer as a URL, or as `host:port`
+        :return: <requests.Session> The peer's session, created on first use
+        """
+
+        key = self.key(peer)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=self.pool_size,
+                                      pool_block=True)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.sessions[key] = session
+        return session
+
+    def get(self, peer, path, **kwargs):
+        return self.session(peer).get(self.url(peer, path), **kwargs)
+
+    def post(self, peer, path, **kwargs):
+        return self.session(peer).post(self.url(peer, path), **kwargs)
+
+    def discard(self, peer):
+        """
+        Close a peer's connections, e.g. when it is dropped
+        """
+
+        with self.lock:
+            session = self.sessions.pop(self.key(peer), None)
+        if session is not None:
+            session.close()
+
+    def close(self):
+        with self.lock:
+            sessions, self.sessions = self.sessions, {}
+        for session in sessions.values():
+            session.close()
@@ -0,0 +1,213 @@
+#
+# Dependencies
+#
+
+import os
+import sys
+import importlib
+import pytest
+import requests
+from urllib.parse import urlparse
+
+#
+# Define how lessons are loaded
+#
+
+# The repository root, which holds one directory per lesson
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules the lessons import from their own directories
+LESSON_MODULES = ('blockchain', 'blockstore', 'mempool', 'peers', 'miner')
+
+# Lessons whose nodes keep a block tree and talk to peers
+NETWORKED_LESSONS = ('communication_gp', 'credit_for_mining_p')
+
+
+def load(lesson, module):
+    """
+    Import a fresh copy of one of a lesson's modules
+
+    Every lesson has its own `blockchain.py` and friends under the same
+    names, so whatever another lesson imported is forgotten first.
+    :param lesson: <str> The lesson's directory
+    :param module: <str> The module's name
+    :return: <module>
+    """
+
+    for name in LESSON_MODULES:
+        sys.modules.pop(name, None)
+
+    directory = os.path.join(ROOT, lesson)
+    sys.path.insert(0, directory)
+    try:
+        return importlib.import_module(module)
+    finally:
+        sys.path.remove(directory)
+
+
+@pytest.fixture(params=NETWORKED_LESSONS)
+def lesson(request):
+    return request.param
+
+
+@pytest.fixture
+def node(lesson):
+    """
+    The `blockchain` module of each networked lesson
+    """
+
+    return load(lesson, 'blockchain')
+
+
+@pytest.fixture
+def mempool():
+    """
+    The `mempool` module, which every lesson has the same copy of
+    """
+
+    return load('basic_block_gp', 'mempool')
+
+
+@pytest.fixture
+def blockstore():
+    """
+    The `blockstore` module, which every lesson has the same copy of
+    """
+
+    return load('basic_block_gp', 'blockstore')
+
+
+@pytest.fixture
+def miner(lesson):
+    """
+    The `miner` module of each networked lesson
+    """
+
+    return load(lesson, 'miner')
+
+
+@pytest.fixture
+def spawn(lesson):
+    """
+    Start nodes of the lesson, each with its own copy of the module
+    """
+
+    def spawn():
+        module = load(lesson, 'blockchain')
+        module.blockchain = module.Blockchain()
+        return module
+
+    return spawn
+
+#
+# Define a network of test clients
+#
+
+class ClientResponse(object):
+    """
+    The parts of a `requests.Response` the nodes use, over a Flask test
+    client's response
+    """
+
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+
+    def json(self):
+        return self.response.get_json()
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} Error')
+
+
+class ClientPeers(object):
+    """
+    Stands in for `PeerSessions`, sending each request to the peer node's
+    Flask test client instead of over HTTP
+
+    Requests for which `fail(peer, path, params)` is true raise a
+    ConnectionError instead.
+    """
+
+    def __init__(self, nodes, fail=None):
+        self.nodes = nodes
+        self.fail = fail or (lambda peer, path, params: False)
+
+    def client(self, peer, path, params):
+        if self.fail(peer, path, params):
+            raise requests.ConnectionError(f'{peer} is down')
+        return self.nodes[urlparse(peer).netloc or peer].app.test_client()
+
+    def get(self, peer, path, params=None, **kwargs):
+        client = self.client(peer, path, params)
+        return ClientResponse(client.get(path, query_string=params or {}))
+
+    def post(self, peer, path, json=None, **kwargs):
+        client = self.client(peer, path, None)
+        return ClientResponse(client.post(path, json=json))
+
+
+def connect(module, peers, **kwargs):
+    """
+    Have a node reach each of `peers`, by name, through ClientPeers
+    """
+
+    module.blockchain.peers = ClientPeers(peers, **kwargs)
+    for name in peers:
+        module.blockchain.register_node(f'http://{name}')
+
+
+def forge_block(node, parent, transactions=(), salt=0):
+    """
+    Mine a block on top of `parent`
+
+    :param node: <module> A lesson's `blockchain` module
+    :param parent: <dict> The block to build on
+    :param transactions: (Optional) <list> The block's transactions
+    :param salt: (Optional) <int> Tells apart blocks that are otherwise the
+    same, such as siblings on two branches
+    :return: <Block>
+    """
+
+    prefix = node.Blockchain.proof_prefix(node.Blockchain.encode(parent))
+    proof = 0
+    while not node.Blockchain.valid_guess(prefix, proof):
+        proof += 1
+
+    return node.Block({
+        'index': parent['index'] + 1,
+        'timestamp': 1000 + parent['index'] + salt / 1000,
+        'transactions': list(transactions),
+        'proof': proof,
+        'previous_hash': node.Blockchain.hash(parent),
+    })
+
+
+def extend_chain(node, blockchain, count, salt=0):
+    """
+    Mine `count` blocks onto the end of `blockchain`
+
+    :return: <list> The new blocks
+    """
+
+    blocks = []
+    for _ in range(count):
+        blocks.append(forge_block(node, blockchain.last_block, salt=salt))
+        assert blockchain.add_block(dict(blocks[-1])) == 'extended'
+    return blocks
+
+
+@pytest.fixture
+def forge():
+    return forge_block
+
+
+@pytest.fixture
+def extend():
+    return extend_chain
+
+
+@pytest.fixture
+def network():
+    return connect
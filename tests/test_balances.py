@@ -0,0 +1,130 @@
+import pytest
+
+
+# Only this lesson keeps balances
+@pytest.fixture
+def lesson():
+    return 'credit_for_mining_p'
+
+
+def reward(address, amount=1):
+    return {'sender': '0', 'recipient': address, 'amount': amount}
+
+
+def spend(sender, recipient, amount=1):
+    return {'sender': sender, 'recipient': recipient, 'amount': amount}
+
+
+def test_rolled_back_spend_is_dropped_once_unaffordable(node, forge):
+    blockchain = node.Blockchain()
+    genesis = blockchain.last_block
+
+    # bob earns a coin and spends it on one branch...
+    first = forge(node, genesis, [reward('bob')])
+    second = forge(node, first, [spend('bob', 'carol')])
+    assert blockchain.add_block(dict(first)) == 'extended'
+    assert blockchain.add_block(dict(second)) == 'extended'
+    assert blockchain.balances['carol'] == 1
+
+    # ...which a branch where he never earned it overtakes
+    side = genesis
+    for _ in range(3):
+        side = forge(node, side, [reward('dave')], salt=1)
+        blockchain.add_block(dict(side))
+    assert blockchain.last_block == side
+
+    assert blockchain.balances.get('bob', 0) == 0
+    assert blockchain.balances.get('carol', 0) == 0
+    assert len(blockchain.mempool) == 0
+
+
+def test_rolled_back_spend_is_requeued_while_affordable(node, forge):
+    blockchain = node.Blockchain()
+    genesis = blockchain.last_block
+
+    earned = forge(node, genesis, [reward('bob')])
+    spent = forge(node, earned, [spend('bob', 'carol')])
+    blockchain.add_block(dict(earned))
+    blockchain.add_block(dict(spent))
+
+    # The other branch pays bob too, but doesn't carry his spend
+    side = forge(node, earned, salt=1)
+    assert blockchain.add_block(dict(side)) == 'side'
+    side = forge(node, side, salt=1)
+    assert blockchain.add_block(dict(side)) == 'reorganized'
+
+    assert blockchain.balances['bob'] == 1
+    assert [tx for tx in blockchain.mempool.take(10)] == [spend('bob', 'carol')]
+
+
+def test_block_spending_more_than_its_sender_has_is_invalid(node, forge):
+    blockchain = node.Blockchain()
+    earned = forge(node, blockchain.last_block, [reward('bob')])
+    assert blockchain.add_block(dict(earned)) == 'extended'
+
+    # Coins can't be spent in the block before the one paying them
+    overspent = forge(node, earned, [spend('bob', 'carol', 2)])
+    assert blockchain.add_block(dict(overspent)) == 'invalid'
+    early = forge(node, earned, [spend('carol', 'dave'), reward('carol')])
+    assert blockchain.add_block(dict(early)) == 'invalid'
+
+    assert len(blockchain.chain) == 2
+    assert blockchain.balances == {'bob': 1}
+
+
+def test_branch_that_overspends_is_not_reorganized_onto(node, forge, extend):
+    blockchain = node.Blockchain()
+    genesis = blockchain.last_block
+    main = extend(node, blockchain, 2)
+
+    side = forge(node, genesis, salt=1)
+    blockchain.add_block(dict(side))
+    side = forge(node, side, salt=1)
+    blockchain.add_block(dict(side))
+    side = forge(node, side, [spend('bob', 'carol')], salt=1)
+    assert blockchain.add_block(dict(side)) == 'invalid'
+
+    assert blockchain.last_block == main[-1]
+    assert blockchain.balances.get('carol', 0) == 0
+    assert blockchain.validate(full=True)
+
+
+def test_mined_block_leaves_out_spends_made_unaffordable(node, forge):
+    blockchain = node.Blockchain()
+    genesis = blockchain.last_block
+    earned = forge(node, genesis, [reward('bob')])
+    blockchain.add_block(dict(earned))
+    blockchain.new_transaction('bob', 'carol', 1)
+
+    # bob's coin is taken away while his spend waits in the mempool
+    side = forge(node, genesis, salt=1)
+    blockchain.add_block(dict(side))
+    side = forge(node, side, salt=1)
+    assert blockchain.add_block(dict(side)) == 'reorganized'
+
+    block = blockchain.new_block(0)
+    assert block['transactions'] == []
+    assert blockchain.balances.get('bob', 0) == 0
+
+
+def test_clients_cannot_mint_coins(node):
+    node.blockchain = node.Blockchain()
+    client = node.app.test_client()
+
+    minted = client.post('/transactions/new', json=spend('0', 'me', 10 ** 9))
+    assert minted.status_code == 400
+    batch = client.post('/transactions/batch', json=[spend('0', 'me', 10 ** 9)]).get_json()
+    assert batch['results'] == [{'error': 'Invalid Sender'}]
+    assert len(node.blockchain.mempool) == 0
+
+
+def test_block_minting_more_than_the_reward_is_invalid(node, forge):
+    blockchain = node.Blockchain()
+    parent = blockchain.last_block
+
+    minted = forge(node, parent, [reward('evil', 10 ** 6)])
+    assert blockchain.add_block(dict(minted)) == 'invalid'
+    twice = forge(node, parent, [reward('evil'), reward('evil')])
+    assert blockchain.add_block(dict(twice)) == 'invalid'
+
+    assert blockchain.balances == {}
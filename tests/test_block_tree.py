@@ -0,0 +1,74 @@
+def test_side_branch_with_more_work_is_reorganized_onto(node, forge, extend):
+    blockchain = node.Blockchain()
+    genesis = blockchain.last_block
+    main = extend(node, blockchain, 2)
+
+    side = [forge(node, genesis, salt=1)]
+    side.append(forge(node, side[-1], salt=1))
+    assert blockchain.add_block(dict(side[0])) == 'side'
+    assert blockchain.add_block(dict(side[1])) == 'side'
+    assert blockchain.last_block == main[-1]
+
+    side.append(forge(node, side[-1], salt=1))
+    assert blockchain.add_block(dict(side[2])) == 'reorganized'
+
+    assert list(blockchain.chain) == [genesis] + side
+    assert set(blockchain.side_blocks) == {node.Blockchain.hash(b) for b in main}
+    assert blockchain.validate(full=True)
+
+
+def test_block_already_in_the_tree_is_known(node, extend):
+    blockchain = node.Blockchain()
+    block = extend(node, blockchain, 1)[0]
+
+    assert blockchain.add_block(dict(block)) == 'known'
+    assert len(blockchain.chain) == 2
+
+
+def test_block_with_a_bad_proof_is_invalid(node, forge):
+    blockchain = node.Blockchain()
+    block = forge(node, blockchain.last_block)
+    block['proof'] += 1
+
+    assert blockchain.add_block(dict(block)) == 'invalid'
+    assert len(blockchain.chain) == 1
+
+
+def test_deep_side_branches_are_pruned_whole(node, forge, extend, monkeypatch):
+    monkeypatch.setattr(node, 'MAX_FORK_DEPTH', 3)
+    blockchain = node.Blockchain()
+
+    # A side branch keeping pace with our chain from the genesis block,
+    # until it forks off too far down to keep
+    side = blockchain.last_block
+    for _ in range(6):
+        extend(node, blockchain, 1)
+        side = forge(node, side, salt=1)
+        blockchain.add_block(dict(side))
+
+    # No side block is left without its parent
+    for block, work in blockchain.side_blocks.values():
+        assert blockchain.find_block(block['previous_hash'], block['index'] - 1) is not None
+
+    # Growing the dropped branch past our chain mustn't reorganize onto it
+    for _ in range(3):
+        side = forge(node, side, salt=1)
+        assert blockchain.add_block(dict(side)) == 'orphan'
+    assert len(blockchain.chain) == 7
+    assert blockchain.validate(full=True)
+
+
+def test_shallow_side_branch_survives_pruning(node, forge, extend, monkeypatch):
+    monkeypatch.setattr(node, 'MAX_FORK_DEPTH', 3)
+    blockchain = node.Blockchain()
+    fork = extend(node, blockchain, 3)[-2]
+
+    side = forge(node, fork, salt=1)
+    assert blockchain.add_block(dict(side)) == 'side'
+    extend(node, blockchain, 1)
+
+    side = forge(node, side, salt=1)
+    assert blockchain.add_block(dict(side)) == 'side'
+    side = forge(node, side, salt=1)
+    assert blockchain.add_block(dict(side)) == 'reorganized'
+    assert blockchain.last_block == side
@@ -0,0 +1,110 @@
+import os
+import pytest
+
+
+def blocks(count, start=1):
+    return [{'index': index, 'transactions': [], 'proof': index, 'previous_hash': str(index - 1)}
+            for index in range(start, start + count)]
+
+
+def segment_files(path):
+    return sorted(name for name in os.listdir(path) if name.endswith('.seg'))
+
+
+def test_blocks_are_read_back_after_reopening(blockstore, tmp_path):
+    store = blockstore.BlockStore(str(tmp_path))
+    for block in blocks(5):
+        store.append(block)
+    store.close()
+
+    store = blockstore.BlockStore(str(tmp_path))
+    assert list(store) == blocks(5)
+    assert store[-1].hash == blockstore.Block(blocks(5)[-1]).hash
+    store.close()
+
+
+@pytest.mark.parametrize('torn', [3, 20])
+def test_torn_last_record_is_truncated_away(blockstore, tmp_path, torn):
+    store = blockstore.BlockStore(str(tmp_path))
+    for block in blocks(3):
+        store.append(block)
+    store.close()
+
+    # A crash part way through the next append, inside its header or its
+    # payload
+    path = os.path.join(str(tmp_path), segment_files(str(tmp_path))[-1])
+    intact = os.path.getsize(path)
+    record = blockstore.Block(blocks(1, start=4)[0]).encoded
+    with open(path, 'ab') as file:
+        file.write(blockstore.HEADER.pack(len(record), 0) + record)
+    os.truncate(path, intact + torn)
+
+    store = blockstore.BlockStore(str(tmp_path))
+    assert list(store) == blocks(3)
+    assert os.path.getsize(path) == intact
+
+    # And appending carries on from there
+    store.append(blocks(1, start=4)[0])
+    store.close()
+    assert list(blockstore.BlockStore(str(tmp_path))) == blocks(4)
+
+
+def test_garbled_last_payload_fails_its_checksum(blockstore, tmp_path):
+    store = blockstore.BlockStore(str(tmp_path))
+    for block in blocks(3):
+        store.append(block)
+    store.close()
+
+    # The header made it to disk whole, but the payload didn't
+    path = os.path.join(str(tmp_path), segment_files(str(tmp_path))[-1])
+    with open(path, 'r+b') as file:
+        file.seek(-2, os.SEEK_END)
+        file.write(b'\0\0')
+
+    assert list(blockstore.BlockStore(str(tmp_path))) == blocks(2)
+
+
+def test_segments_roll_over_and_truncate_across(blockstore, tmp_path):
+    store = blockstore.BlockStore(str(tmp_path), segment_size=256)
+    for block in blocks(20):
+        store.append(block)
+    written = len(segment_files(str(tmp_path)))
+    assert written > 2
+    store.close()
+
+    store = blockstore.BlockStore(str(tmp_path), segment_size=256)
+    assert list(store) == blocks(20)
+
+    del store[3:]
+    assert list(store) == blocks(3)
+    assert len(segment_files(str(tmp_path))) < written
+    store.append(blocks(1, start=4)[0])
+    store.close()
+
+    assert list(blockstore.BlockStore(str(tmp_path), segment_size=256)) == blocks(4)
+
+
+def test_corrupt_record_before_the_last_segment_is_an_error(blockstore, tmp_path):
+    store = blockstore.BlockStore(str(tmp_path), segment_size=256)
+    for block in blocks(20):
+        store.append(block)
+    store.close()
+
+    # Only the last record can be torn, so a short segment before it means
+    # something else went wrong
+    path = os.path.join(str(tmp_path), segment_files(str(tmp_path))[0])
+    os.truncate(path, os.path.getsize(path) - 1)
+
+    with pytest.raises(IOError):
+        blockstore.BlockStore(str(tmp_path), segment_size=256)
+
+
+def test_reads_see_blocks_appended_after_mapping(blockstore, tmp_path):
+    store = blockstore.BlockStore(str(tmp_path), fsync='never')
+    store.append(blocks(1)[0])
+    assert store[0] == blocks(1)[0]
+
+    for block in blocks(3, start=2):
+        store.append(block)
+    assert [store.read(position) for position in range(4)] == blocks(4)
+    store.close()
@@ -0,0 +1,70 @@
+import pytest
+
+
+# Every lesson keeps a verified checkpoint
+@pytest.fixture(params=['basic_block_gp', 'client_mining_p', 'communication_gp', 'credit_for_mining_p'])
+def lesson(request):
+    return request.param
+
+
+@pytest.fixture(autouse=True)
+def easy(node, monkeypatch):
+    """
+    Mine at a low difficulty, which `client_mining_p` doesn't
+    """
+
+    valid_guess = node.Blockchain.valid_guess
+    target = node.proof_target(8)
+    monkeypatch.setattr(node.Blockchain, 'valid_guess',
+                        staticmethod(lambda prefix, proof, *args: valid_guess(prefix, proof, target)))
+
+
+def mine(node, blockchain):
+    prefix = node.Blockchain.proof_prefix(node.Blockchain.encode(blockchain.last_block))
+    proof = 0
+    while not node.Blockchain.valid_guess(prefix, proof):
+        proof += 1
+    return blockchain.new_block(proof)
+
+
+def save(blockchain):
+    # The networked lessons save it along with their indexes
+    if hasattr(blockchain, 'save_indexes'):
+        blockchain.save_indexes()
+    else:
+        blockchain.save_checkpoint()
+
+
+def test_restart_picks_the_checkpoint_back_up(node, tmp_path, monkeypatch):
+    store = node.BlockStore(str(tmp_path))
+    blockchain = node.Blockchain(store)
+    for _ in range(5):
+        mine(node, blockchain)
+    save(blockchain)
+    store.close()
+
+    checked = []
+    valid_link = node.Blockchain.valid_link
+    monkeypatch.setattr(node.Blockchain, 'valid_link',
+                        lambda self, *args: checked.append(args[-1]) or valid_link(self, *args))
+
+    reopened = node.Blockchain(node.BlockStore(str(tmp_path)))
+    assert reopened.verified_height == 6
+    mine(node, reopened)
+    assert checked == [6]
+
+
+def test_checkpoint_past_a_rollback_starts_again(node, tmp_path):
+    store = node.BlockStore(str(tmp_path))
+    blockchain = node.Blockchain(store)
+    for _ in range(4):
+        mine(node, blockchain)
+    save(blockchain)
+
+    # Crash after the chain was cut back beneath the checkpoint
+    del store[3:]
+    store.close()
+
+    reopened = node.Blockchain(node.BlockStore(str(tmp_path)))
+    assert reopened.validate()
+    assert reopened.verified_height == 3
@@ -0,0 +1,129 @@
+def spend(sender, recipient, amount=1):
+    return {'sender': sender, 'recipient': recipient, 'amount': amount}
+
+
+def fill(node, blockchain, forge, count):
+    """
+    Add `count` blocks, each paying alice a reward she passes on to bob
+    """
+
+    for _ in range(count):
+        block = forge(node, blockchain.last_block, [spend('0', 'alice'), spend('alice', 'bob')])
+        assert blockchain.add_block(dict(block)) == 'extended'
+
+
+def indexes(blockchain):
+    # An address whose coins have all gone has no balance left to tell apart
+    # from one that never had any
+    balances = {address: balance for address, balance in getattr(blockchain, 'balances', {}).items()
+                if balance}
+    return blockchain.address_index, blockchain.tx_index, balances
+
+
+def test_indexes_are_picked_up_from_where_they_were_saved(node, forge, tmp_path, monkeypatch):
+    store = node.BlockStore(str(tmp_path))
+    blockchain = node.Blockchain(store)
+    fill(node, blockchain, forge, 3)
+    blockchain.save_indexes()
+    fill(node, blockchain, forge, 2)
+    expected = indexes(blockchain)
+    store.close()
+
+    # Only the two blocks added since the save are decoded again
+    indexed = []
+    index_transactions = node.Blockchain.index_transactions
+    monkeypatch.setattr(node.Blockchain, 'index_transactions',
+                        lambda self, block: indexed.append(block['index']) or index_transactions(self, block))
+
+    reopened = node.Blockchain(node.BlockStore(str(tmp_path)))
+    assert indexed == [5, 6]
+    assert indexes(reopened) == expected
+
+
+def test_indexes_are_saved_every_few_blocks(node, forge, tmp_path, monkeypatch):
+    monkeypatch.setattr(node, 'INDEX_SAVE_INTERVAL', 2)
+    store = node.BlockStore(str(tmp_path))
+    blockchain = node.Blockchain(store)
+    fill(node, blockchain, forge, 1)
+    blockchain.save_pool.shutdown(wait=True)
+    fill(node, blockchain, forge, 1)
+    expected = indexes(blockchain)
+    store.close()
+
+    # Killed without the save at shutdown, which leaves the one made once
+    # the chain was two blocks long
+    indexed = []
+    index_transactions = node.Blockchain.index_transactions
+    monkeypatch.setattr(node.Blockchain, 'index_transactions',
+                        lambda self, block: indexed.append(block['index']) or index_transactions(self, block))
+
+    reopened = node.Blockchain(node.BlockStore(str(tmp_path)))
+    assert indexed == [3]
+    assert indexes(reopened) == expected
+
+
+def test_indexes_saved_past_a_rollback_are_rebuilt(node, forge, tmp_path):
+    store = node.BlockStore(str(tmp_path))
+    blockchain = node.Blockchain(store)
+    fill(node, blockchain, forge, 4)
+    blockchain.save_indexes()
+
+    # Crash after a reorganization onto a branch without those blocks
+    blockchain.replace_blocks(2, [])
+    fill(node, blockchain, forge, 1)
+    expected = indexes(blockchain)
+    store.close()
+
+    reopened = node.Blockchain(node.BlockStore(str(tmp_path)))
+    assert indexes(reopened) == expected
+    assert len(reopened.address_index['bob']) == 2
+
+
+def test_address_transactions_page_through_the_index(node, forge):
+    node.blockchain = node.Blockchain()
+    fill(node, node.blockchain, forge, 5)
+    client = node.app.test_client()
+
+    page = client.get('/address/bob/transactions', query_string={'limit': 2}).get_json()
+    assert [tx['block'] for tx in page['transactions']] == [2, 3]
+    assert page['length'] == 5
+    page = client.get('/address/bob/transactions', query_string={'cursor': page['next']}).get_json()
+    assert [tx['block'] for tx in page['transactions']] == [4, 5, 6]
+    assert page['next'] is None
+
+    tx_id = page['transactions'][0]['id']
+    found = client.get(f'/tx/{tx_id}').get_json()
+    assert found['locations'] == [{'block': block, 'position': 1} for block in range(2, 7)]
+
+
+def test_reorganizing_rolls_back_indexes_and_balances(node, forge):
+    blockchain = node.Blockchain()
+    genesis = blockchain.last_block
+    fill(node, blockchain, forge, 2)
+
+    # A longer branch where carol is paid instead
+    branch = []
+    for _ in range(3):
+        branch.append(forge(node, branch[-1] if branch else genesis, [spend('0', 'carol')], salt=1))
+        blockchain.add_block(dict(branch[-1]))
+    assert blockchain.last_block == branch[-1]
+
+    # Just as if the branch had been our chain all along
+    fresh = node.Blockchain()
+    for block in branch:
+        assert fresh.add_block(dict(block)) == 'extended'
+    assert indexes(blockchain) == indexes(fresh)
+    assert 'bob' not in blockchain.address_index
+
+
+def test_confirmed_transaction_with_a_nonce_is_not_taken_again(spawn):
+    node = spawn()
+    client = node.app.test_client()
+    tx = {'sender': 'alice', 'recipient': 'bob', 'amount': 1, 'nonce': 7}
+    if hasattr(node, 'MINING_REWARD'):
+        node.blockchain.balances['alice'] = 2
+
+    assert client.post('/transactions/new', json=tx).status_code == 201
+    node.blockchain.new_block(0)
+    assert client.post('/transactions/new', json=tx).status_code == 400
+    assert client.post('/transactions/new', json=dict(tx, nonce=None)).status_code == 201
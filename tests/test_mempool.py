@@ -0,0 +1,72 @@
+import pytest
+
+
+def payment(sender='alice', recipient='bob', amount=1):
+    return {'sender': sender, 'recipient': recipient, 'amount': amount}
+
+
+def test_repeated_transaction_is_a_duplicate(mempool):
+    pool = mempool.Mempool()
+    tx_id = pool.add(payment())
+
+    with pytest.raises(mempool.TransactionRejected, match='Duplicate'):
+        pool.add(payment())
+    assert pool.add_many([payment(amount=2), payment(amount=2)])[1].args == ('Duplicate Transaction',)
+    assert len(pool) == 2
+
+    # Once it has left the pool, it can come back
+    pool.remove([payment()])
+    assert pool.get(tx_id) is None
+    assert pool.add(payment()) == tx_id
+
+
+def test_nonces_tell_identical_payments_apart(mempool):
+    pool = mempool.Mempool()
+    first = pool.add(mempool.make_transaction('alice', 'bob', 1, nonce=1))
+    second = pool.add(mempool.make_transaction('alice', 'bob', 1, nonce=2))
+
+    assert first != second
+    assert len(pool.from_sender('alice')) == 2
+    assert mempool.make_transaction('alice', 'bob', 1) == payment()
+
+
+def test_rewards_go_first_then_arrival_order(mempool):
+    pool = mempool.Mempool()
+    pool.add(payment(amount=1))
+    pool.add(payment(amount=2))
+    pool.add(payment(sender='0', recipient='miner'))
+
+    assert pool.take(2) == [payment(sender='0', recipient='miner'), payment(amount=1)]
+    assert list(pool) == [payment(amount=2)]
+
+
+def test_full_pool_turns_newcomers_away_but_evicts_for_rewards(mempool):
+    size = len(mempool.json.dumps(payment(), sort_keys=True)) + mempool.ENTRY_OVERHEAD
+    pool = mempool.Mempool(max_bytes=2 * size)
+    pool.add(payment(amount=1))
+    pool.add(payment(amount=2))
+
+    with pytest.raises(mempool.TransactionRejected):
+        pool.add(payment(amount=3))
+
+    # Of equals, the newest is evicted first
+    pool.add(payment(sender='0', recipient='miner'))
+    assert list(pool) == [payment(amount=1), payment(sender='0', recipient='miner')]
+
+
+def test_rejected_transaction_leaves_the_pool_as_it_was(mempool):
+    size = len(mempool.json.dumps(payment(), sort_keys=True)) + mempool.ENTRY_OVERHEAD
+    pool = mempool.Mempool(max_bytes=2 * size)
+    pool.add(payment())
+    pool.add(payment(sender='0', recipient='miner'))
+
+    with pytest.raises(mempool.TransactionRejected):
+        pool.add(payment(sender=['alice']))
+
+    # Evicting the payment alone wouldn't make room for this reward, so
+    # nothing is evicted
+    with pytest.raises(mempool.TransactionRejected):
+        pool.add(payment(sender='0', recipient='miner' * 20))
+
+    assert len(pool) == 2
+    assert pool.take(3) == [payment(sender='0', recipient='miner'), payment()]
@@ -0,0 +1,48 @@
+import threading
+import pytest
+
+
+@pytest.mark.parametrize('timeout', ['nan', 'inf', '-inf', 'soon'])
+def test_work_turns_down_timeouts_that_never_end(spawn, timeout):
+    node = spawn()
+    client = node.app.test_client()
+
+    response = client.get('/work', query_string={'since': 'stale', 'timeout': timeout})
+    assert response.status_code == 400
+
+    # A negative timeout is only clamped, and answers straight away
+    response = client.get('/work', query_string={'since': 'stale', 'timeout': -5})
+    assert response.get_json()['last-block'] == node.blockchain.last_block
+
+
+def test_proof_of_zero_is_a_proof(spawn, monkeypatch):
+    node = spawn()
+    monkeypatch.setattr(node.blockchain, 'valid_proof', lambda block_string, proof: proof == 0)
+
+    response = node.app.test_client().post('/mine', json={'proof': 0, 'id': 'miner'})
+    assert response.get_json()['message'] == 'New Block Forged'
+    assert node.blockchain.last_block['proof'] == 0
+
+
+class Answer(object):
+
+    def __init__(self, content):
+        self.content = content
+
+
+class Session(object):
+
+    def __init__(self, content):
+        self.content = content
+
+    def get(self, url, **kwargs):
+        return Answer(self.content)
+
+
+def test_watcher_reports_an_answer_without_a_hash(miner):
+    work, new_work = {}, threading.Event()
+
+    miner.watch_for_work(Session(b'{"message": "Not Found"}'), 'http://node', work, new_work)
+
+    assert new_work.is_set()
+    assert isinstance(work['error'], KeyError)
@@ -0,0 +1,73 @@
+def test_orphan_connects_when_its_parent_arrives(node, forge):
+    blockchain = node.Blockchain()
+    parent = forge(node, blockchain.last_block)
+    child = forge(node, parent)
+
+    assert blockchain.add_block(dict(child)) == 'orphan'
+    assert node.Blockchain.hash(child) in blockchain.orphans
+
+    assert blockchain.add_block(dict(parent)) == 'extended'
+    assert blockchain.last_block == child
+    assert not blockchain.orphans
+
+
+def test_held_orphan_fetches_its_missing_parent(spawn, network, extend):
+    ours, theirs = spawn(), spawn()
+    blocks = extend(theirs, theirs.blockchain, 3)
+    ours.blockchain.add_block(dict(blocks[0]))
+    network(ours, {'peer': theirs})
+
+    # The block before this one never reached us
+    response = ours.app.test_client().post('/block/new', json={
+        'block': blocks[2],
+        'node': 'http://peer',
+    })
+    assert response.status_code == 202
+
+    ours.blockchain.consensus_pool.shutdown(wait=True)
+    assert ours.blockchain.last_block == blocks[2]
+    assert not ours.blockchain.orphans
+
+
+def test_orphan_on_a_fork_connects_the_fork(spawn, network, extend):
+    ours, theirs = spawn(), spawn()
+    extend(ours, ours.blockchain, 1, salt=1)
+    blocks = extend(theirs, theirs.blockchain, 2)
+    network(ours, {'peer': theirs})
+
+    assert ours.blockchain.add_block(dict(blocks[1])) == 'orphan'
+    assert ours.blockchain.fetch_ancestors('http://peer', blocks[1])
+    assert ours.blockchain.last_block == blocks[1]
+
+
+def test_orphan_far_past_the_fork_falls_back_to_sync(spawn, network, extend):
+    ours, theirs = spawn(), spawn()
+    extend(ours, ours.blockchain, 4, salt=1)
+    blocks = extend(theirs, theirs.blockchain, 6)
+    network(ours, {'peer': theirs})
+
+    assert ours.blockchain.add_block(dict(blocks[-1])) == 'orphan'
+    assert ours.blockchain.fetch_ancestors('http://peer', blocks[-1])
+    assert list(ours.blockchain.chain) == list(theirs.blockchain.chain)
+
+
+def test_block_far_ahead_syncs_in_the_background(spawn, network, extend, monkeypatch):
+    ours, theirs = spawn(), spawn()
+    blocks = extend(theirs, theirs.blockchain, 8)
+    network(ours, {'peer': theirs})
+
+    # The sync itself uses the pool, so wait on what the route submits
+    # rather than shutting the pool down
+    submitted = []
+    submit = ours.blockchain.consensus_pool.submit
+    monkeypatch.setattr(ours.blockchain.consensus_pool, 'submit',
+                        lambda *args: submitted.append(submit(*args)) or submitted[-1])
+
+    response = ours.app.test_client().post('/block/new', json={
+        'block': blocks[-1],
+        'node': 'http://peer',
+    })
+    assert response.status_code == 202
+
+    assert submitted[0].result()
+    assert list(ours.blockchain.chain) == list(theirs.blockchain.chain)
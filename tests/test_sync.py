@@ -0,0 +1,109 @@
+def test_node_far_behind_catches_up(spawn, network, extend, monkeypatch):
+    ours, theirs = spawn(), spawn()
+    monkeypatch.setattr(ours, 'SYNC_BATCH_SIZE', 5)
+    extend(theirs, theirs.blockchain, 23)
+    network(ours, {'peer': theirs})
+
+    assert ours.blockchain.resolve_conflicts()
+    assert list(ours.blockchain.chain) == list(theirs.blockchain.chain)
+    assert ours.blockchain.validate(full=True)
+
+
+def test_node_on_a_fork_switches_to_the_longer_chain(spawn, network, extend, monkeypatch):
+    ours, theirs = spawn(), spawn()
+    monkeypatch.setattr(ours, 'SYNC_BATCH_SIZE', 5)
+    shared = extend(theirs, theirs.blockchain, 4)
+    for block in shared:
+        ours.blockchain.add_block(dict(block))
+    extend(ours, ours.blockchain, 6, salt=1)
+    extend(theirs, theirs.blockchain, 9)
+    network(ours, {'peer': theirs})
+
+    assert ours.blockchain.resolve_conflicts()
+    assert list(ours.blockchain.chain) == list(theirs.blockchain.chain)
+
+
+def test_sync_cut_short_keeps_what_it_got(spawn, network, extend, monkeypatch):
+    ours, theirs = spawn(), spawn()
+    monkeypatch.setattr(ours, 'SYNC_BATCH_SIZE', 5)
+    extend(theirs, theirs.blockchain, 20)
+
+    # The peer stops sending blocks past the first two batches
+    network(ours, {'peer': theirs},
+            fail=lambda peer, path, params: path == '/chain' and params['from'] > 10)
+    assert ours.blockchain.resolve_conflicts()
+    assert len(ours.blockchain.chain) == 11
+
+    network(ours, {'peer': theirs})
+    assert ours.blockchain.resolve_conflicts()
+    assert list(ours.blockchain.chain) == list(theirs.blockchain.chain)
+
+
+def misnumbered_chain(node, blockchain, forge, count, bad):
+    """
+    Give `blockchain` `count` more blocks that link up, with the `bad`th of
+    them claiming the wrong index
+    """
+
+    for number in range(count):
+        block = forge(node, blockchain.last_block)
+        if number == bad:
+            block['index'] += 5
+        blockchain.chain.append(block)
+        blockchain.tip = block
+
+
+def test_synced_branch_with_a_bad_index_is_rejected(spawn, network, forge, monkeypatch):
+    ours, theirs = spawn(), spawn()
+    monkeypatch.setattr(ours, 'SYNC_BATCH_SIZE', 5)
+    misnumbered_chain(theirs, theirs.blockchain, forge, 4, bad=1)
+    network(ours, {'peer': theirs})
+
+    assert not ours.blockchain.resolve_conflicts()
+    assert len(ours.blockchain.chain) == 1
+
+
+def test_synced_batches_with_a_bad_index_are_rejected(spawn, network, forge, monkeypatch):
+    ours, theirs = spawn(), spawn()
+    monkeypatch.setattr(ours, 'SYNC_BATCH_SIZE', 3)
+    misnumbered_chain(theirs, theirs.blockchain, forge, 6, bad=4)
+    network(ours, {'peer': theirs})
+
+    # The first batch replaces our chain, and the second is ingested up to
+    # the bad block
+    assert ours.blockchain.resolve_conflicts()
+    assert list(ours.blockchain.chain) == list(theirs.blockchain.chain)[:5]
+
+
+def test_chain_on_another_genesis_block_is_not_synced(spawn, network, extend):
+    ours, theirs = spawn(), spawn()
+    genesis = ours.blockchain.last_block
+    forged = ours.Block(genesis, previous_hash='0',
+                        transactions=[{'sender': '0', 'recipient': 'evil', 'amount': 1000}])
+    theirs.blockchain.chain[0] = forged
+    theirs.blockchain.tip = forged
+    extend(theirs, theirs.blockchain, 5)
+    network(ours, {'peer': theirs})
+
+    assert not ours.blockchain.resolve_conflicts()
+    assert list(ours.blockchain.chain) == [genesis]
+
+
+def test_sync_round_stops_once_out_of_time(spawn, network, extend, monkeypatch):
+    ours, theirs = spawn(), spawn()
+    monkeypatch.setattr(ours, 'SYNC_BATCH_SIZE', 5)
+    monkeypatch.setattr(ours, 'SYNC_TIMEOUT', 2)
+    extend(theirs, theirs.blockchain, 20)
+    network(ours, {'peer': theirs})
+
+    # Every batch applied takes a second
+    clock = [0]
+    monkeypatch.setattr(ours, 'monotonic', lambda: clock[0])
+    for name in ('replace_blocks', 'add_blocks'):
+        def applied(*args, apply=getattr(ours.blockchain, name), **kwargs):
+            clock[0] += 1
+            return apply(*args, **kwargs)
+        monkeypatch.setattr(ours.blockchain, name, applied)
+
+    assert ours.blockchain.resolve_conflicts()
+    assert len(ours.blockchain.chain) == 11
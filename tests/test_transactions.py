@@ -0,0 +1,60 @@
+import pytest
+
+
+# Every lesson takes transactions the same way
+@pytest.fixture(params=['basic_block_gp', 'client_mining_p', 'communication_gp', 'credit_for_mining_p'])
+def lesson(request):
+    return request.param
+
+
+@pytest.mark.parametrize('values', [
+    {'sender': ['alice'], 'recipient': 'bob', 'amount': 1},
+    {'sender': 'alice', 'recipient': {'bob': 1}, 'amount': 1},
+    {'sender': 'alice', 'recipient': 'bob', 'amount': '1'},
+    {'sender': 'alice', 'recipient': 'bob', 'amount': -1},
+    ['alice', 'bob', 1],
+])
+def test_malformed_transaction_is_a_bad_request(node, values):
+    node.blockchain = node.Blockchain()
+    client = node.app.test_client()
+
+    assert client.post('/transactions/new', json=values).status_code == 400
+    assert len(node.blockchain.mempool) == 0
+
+
+def test_transaction_with_a_nonce_is_taken_once(node):
+    node.blockchain = node.Blockchain()
+    client = node.app.test_client()
+    tx = {'sender': '0', 'recipient': 'bob', 'amount': 1}
+    if hasattr(node, 'MINING_REWARD'):
+        # Only the mining reward may come from "0" here
+        node.blockchain.balances['alice'] = 2
+        tx['sender'] = 'alice'
+
+    assert client.post('/transactions/new', json=dict(tx, nonce='a')).status_code == 201
+    assert client.post('/transactions/new', json=dict(tx, nonce='a')).status_code == 400
+    assert client.post('/transactions/new', json=dict(tx, nonce='b')).status_code == 201
+    assert len(node.blockchain.mempool) == 2
+
+
+
+def test_batch_reports_malformed_items_and_takes_the_rest(node):
+    node.blockchain = node.Blockchain()
+    client = node.app.test_client()
+    good = {'sender': '0', 'recipient': 'bob', 'amount': 1}
+    if hasattr(node, 'MINING_REWARD'):
+        node.blockchain.balances['alice'] = 2
+        good['sender'] = 'alice'
+
+    response = client.post('/transactions/batch', json=[
+        good,
+        {'sender': {'a': 1}, 'recipient': 'bob', 'amount': 1},
+        dict(good, nonce=[1]),
+        {'sender': 'alice'},
+    ])
+    assert response.status_code == 201
+    assert [list(result) for result in response.get_json()['results']] == [
+        ['id'], ['error'], ['error'], ['error'],
+    ]
+    assert response.get_json()['results'][1] == {'error': 'Invalid Values'}
+    assert list(node.blockchain.mempool) == [good]
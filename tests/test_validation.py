@@ -0,0 +1,72 @@
+import threading
+import pytest
+
+
+@pytest.fixture
+def chain(node, extend):
+    blockchain = node.Blockchain()
+    extend(node, blockchain, 12)
+    return blockchain
+
+
+def test_parallel_verification_agrees_with_sequential(node, chain, monkeypatch):
+    monkeypatch.setattr(node, 'PARALLEL_VERIFY_MIN', 2)
+    blocks = list(chain.chain)
+
+    assert chain.first_invalid_block(blocks, workers=2) is None
+    assert chain.valid_chain(blocks, workers=2)
+    assert chain.first_invalid_block(blocks, start=5, workers=2) is None
+
+
+@pytest.mark.parametrize('bad', [1, 6, 12])
+def test_parallel_verification_finds_the_first_invalid_block(node, chain, monkeypatch, bad):
+    monkeypatch.setattr(node, 'PARALLEL_VERIFY_MIN', 2)
+    blocks = list(chain.chain)
+    blocks[bad] = node.Block(blocks[bad], proof=blocks[bad]['proof'] + 1)
+
+    assert chain.first_invalid_block(blocks, workers=2) == bad
+    assert not chain.valid_chain(blocks, workers=2)
+    assert not chain.valid_chain(blocks, workers=1)
+
+
+def test_validate_checks_only_blocks_past_the_checkpoint(node, chain, extend):
+    assert chain.validate()
+    checked = chain.verified_height
+    assert checked == len(chain.chain)
+
+    extend(node, chain, 2)
+    assert chain.validate()
+    assert chain.verified_height == checked + 2
+
+
+def test_long_revalidation_runs_in_parallel_without_the_lock(node, chain, monkeypatch):
+    monkeypatch.setattr(node, 'PARALLEL_VERIFY_MIN', 5)
+    chain.verified_height, chain.verified_hash = 0, None
+
+    # Another thread, like a miner, can take the lock while the pool runs
+    took_lock = []
+    first_invalid_block = node.Blockchain.first_invalid_block
+
+    def checked(self, *args, **kwargs):
+        def take():
+            took_lock.append(self.chain_lock.acquire(timeout=5))
+            self.chain_lock.release()
+        thread = threading.Thread(target=take)
+        thread.start()
+        thread.join()
+        return first_invalid_block(self, *args, **kwargs)
+
+    monkeypatch.setattr(node.Blockchain, 'first_invalid_block', checked)
+
+    assert chain.validate()
+    assert took_lock == [True]
+    assert chain.verified_height == 13
+
+
+def test_parallel_revalidation_stops_the_checkpoint_at_a_bad_block(node, chain, monkeypatch):
+    monkeypatch.setattr(node, 'PARALLEL_VERIFY_MIN', 5)
+    assert chain.validate()
+    chain.chain[7] = node.Block(chain.chain[7], proof=chain.chain[7]['proof'] + 1)
+
+    assert not chain.validate(full=True)
+    assert chain.verified_height == 7